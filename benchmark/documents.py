@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+
+from utils import io
+from corenlp import parser, documents
+from benchmark import synthetic
+from benchmark.throughput import best_time, measurement, revision
+
+
+def write_extracted(path, corpus, pages, page_sentences):
+    """Writes pages of synthetic sentences to path,
+    in the format of the extracted wikipedia
+    files."""
+
+    docs = corpus.documents(pages * page_sentences)
+
+    with open(path, 'w') as f:
+        for page_id in xrange(pages):
+            f.write('<doc id="%d" url="https://en.wikipedia.org/wiki?curid=%d" title="Page %d &amp; co&#39;s &#x2013; &quot;x&quot;">\n' % (page_id, page_id, page_id))
+            f.write('Page %d & co\n\n' % page_id)
+
+            for doc in itertools.islice(docs, page_sentences):
+                io.write_string(f, u' '.join(doc['tokens']) + u'.')
+
+            f.write('</doc>\n')
+
+
+def scan_file(path):
+    docs = []
+
+    with open(path, 'r') as f:
+        (xml, text) = parser.scan_next(f)
+        while xml:
+            docs.append((parser.get_page(xml), text))
+            (xml, text) = parser.scan_next(f)
+
+    return docs
+
+
+def split_file(path):
+    return list(documents.iter_documents(path))
+
+
+def main(args):
+    scratch = None
+    paths = args.files
+
+    if not paths:
+        scratch = tempfile.mkdtemp(prefix='snowball_benchmark_')
+        paths = [os.path.join(scratch, 'wiki_00')]
+        corpus = synthetic.SyntheticCorpus(seed=args.seed)
+        write_extracted(paths[0], corpus, args.pages, args.page_sentences)
+
+    try:
+        results = {'scan_next': {'operations': 0, 'seconds': 0.0},
+                   'iter_documents': {'operations': 0, 'seconds': 0.0}}
+
+        for path in paths:
+            (scan_seconds, scanned) = best_time(lambda: scan_file(path), args.repeat)
+            (split_seconds, split) = best_time(lambda: split_file(path), args.repeat)
+
+            if scanned != split:
+                raise ValueError("iter_documents and scan_next disagree on %s" % path)
+
+            results['scan_next']['operations'] += len(scanned)
+            results['scan_next']['seconds'] += scan_seconds
+            results['iter_documents']['operations'] += len(split)
+            results['iter_documents']['seconds'] += split_seconds
+    finally:
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    for name in results:
+        results[name] = measurement(results[name]['operations'], results[name]['seconds'], 'pages')
+
+    print "%-22s %12s %10s %14s" % ('benchmark', 'operations', 'seconds', 'per second')
+    for name in sorted(results):
+        r = results[name]
+        print "%-22s %12d %10.3f %14.1f %s/s" % (name, r['operations'], r['seconds'], r['per_second'], r['unit'])
+    print "speedup: %.1fx" % (results['iter_documents']['per_second'] / results['scan_next']['per_second'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            io.save_json({'revision': revision(),
+                          'python': sys.version.split()[0],
+                          'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                          'parameters': vars(args),
+                          'results': results}, f)
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser()
+
+    argparser.add_argument('files',
+                           nargs='*',
+                           help='Extracted wikipedia files to split (a synthetic one by default)')
+
+    argparser.add_argument('-n', '--pages',
+                           default=5000,
+                           type=int,
+                           help='Pages of the synthetic file')
+
+    argparser.add_argument('-s', '--page-sentences',
+                           default=20,
+                           type=int,
+                           help='Sentences per synthetic page')
+
+    argparser.add_argument('-r', '--repeat',
+                           default=3,
+                           type=int,
+                           help='Rounds per file; the fastest one counts')
+
+    argparser.add_argument('-o', '--output',
+                           help='File to save the results to, as JSON')
+
+    argparser.add_argument('--seed',
+                           default=0,
+                           type=int,
+                           help='Random seed')
+
+    args = argparser.parse_args()
+
+    main(args)
@@ -0,0 +1,184 @@
+import sys
+import random
+import argparse
+
+from classes import classes
+
+
+class Legacy: # stand-in for the former __dict__-backed classes
+    pass
+
+
+def fresh(string):
+    # an uninterned copy, as decoded from a record or the index
+    return string[:1] + string[1:]
+
+
+def legacy_context(ctx):
+    legacy = Legacy()
+    legacy.tokens = ctx.tokens
+    legacy.weight = ctx.weight
+    legacy.ctx = ctx.to_dict() if isinstance(ctx, classes.SparseContext) else dict(ctx.ctx)
+    return legacy
+
+
+def legacy_raw_pattern(pattern):
+    legacy = Legacy()
+    legacy.left_ctx = legacy_context(pattern.left_ctx)
+    legacy.tag_one = fresh(pattern.tag_one)
+    legacy.middle_ctx = legacy_context(pattern.middle_ctx)
+    legacy.tag_two = fresh(pattern.tag_two)
+    legacy.right_ctx = legacy_context(pattern.right_ctx)
+    legacy.page = pattern.page
+    legacy.index = pattern.index
+    return legacy
+
+
+def legacy_candidate_tuple(tup, legacy_patterns):
+    legacy = Legacy()
+    legacy.rel = fresh(tup.rel)
+    legacy.subj = tup.subj
+    legacy.obj = tup.obj
+    legacy.subj_tag = fresh(tup.subj_tag)
+    legacy.obj_tag = fresh(tup.obj_tag)
+    legacy.conf = tup.conf
+    legacy.update_factor = tup.update_factor
+    legacy.patterns = legacy_patterns
+    return legacy
+
+
+def legacy_sentence(sent):
+    legacy = Legacy()
+    legacy.page = sent.page
+    legacy.index = sent.index
+    legacy.tokens = sent.tokens
+    legacy.tagged_tokens = sent.tagged_tokens
+    return legacy
+
+
+def deep_size(obj, seen):
+    """Bytes reachable from obj that are not
+    already in seen, following containers,
+    instance dictionaries and slots."""
+
+    if id(obj) in seen:
+        return 0
+
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for (k, v) in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(x, seen) for x in obj)
+
+    if hasattr(obj, '__dict__'):
+        size += deep_size(obj.__dict__, seen)
+
+    for cls in type(obj).__mro__:
+        for slot in cls.__dict__.get('__slots__', ()):
+            if hasattr(obj, slot):
+                size += deep_size(getattr(obj, slot), seen)
+
+    return size
+
+
+def per_object(objects, shared=()):
+    """Average footprint of objects, not counting
+    what they share with each other or with the
+    objects in shared (e.g. the sentence tokens)."""
+
+    seen = set()
+
+    for obj in shared:
+        deep_size(obj, seen)
+
+    return float(sum(deep_size(obj, seen) for obj in objects)) / len(objects)
+
+
+def create_sentences(count, length):
+    words = [u'word%d' % i for i in xrange(1000)]
+    entities = [u'Entity_%d' % i for i in xrange(100)]
+    sentences = []
+
+    for k in xrange(count):
+        tokens = []
+        tagged_tokens = []
+
+        for _ in xrange(length):
+            if random.random() < 0.15:
+                tag = random.choice([u'PERSON', u'LOCATION'])
+                entity = random.choice(entities)
+                tokens.append(entity)
+                tagged_tokens.append(u"<%s>%s</%s>" % (tag, entity, tag))
+            else:
+                word = random.choice(words)
+                tokens.append(word)
+                tagged_tokens.append(word)
+
+        sentences.append(classes.Sentence(k, 0, tokens, tagged_tokens))
+
+    return sentences
+
+
+def main(args):
+    random.seed(args.seed)
+    sentences = create_sentences(args.sentences, args.length)
+    tokens = [s.tokens for s in sentences] + [s.tagged_tokens for s in sentences]
+
+    # measured before extraction fills the per-sentence caches
+    sentence_row = ('Sentence',
+                    per_object([legacy_sentence(s) for s in sentences], tokens),
+                    per_object(sentences, tokens))
+
+    candidates = []
+
+    for sent in sentences:
+        candidates.extend(sent.extract_candidate_tuples(u'rel', u'PERSON', u'LOCATION'))
+
+    patterns = [p for (_, p) in candidates]
+    legacy_patterns = [legacy_raw_pattern(p) for p in patterns]
+    tuples = []
+    legacy_tuples = []
+
+    for (tup, _) in candidates:
+        support = random.sample(xrange(len(patterns)), args.support)
+        tup.add_patterns([patterns[k] for k in support])
+        tuples.append(tup)
+        legacy_tuples.append(legacy_candidate_tuple(tup, [legacy_patterns[k] for k in support]))
+
+    rows = [('RawPattern', per_object(legacy_patterns, tokens), per_object(patterns, tokens)),
+            ('CandidateTuple', per_object(legacy_tuples, tokens), per_object(tuples, tokens)),
+            sentence_row]
+
+    print "%-16s %12s %12s %8s" % ('type', 'before (B)', 'after (B)', 'ratio')
+    for (name, before, after) in rows:
+        print "%-16s %12.1f %12.1f %8.2f" % (name, before, after, before / after)
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser()
+
+    argparser.add_argument('-n', '--sentences',
+                           default=2000,
+                           type=int,
+                           help='Number of synthetic sentences')
+
+    argparser.add_argument('-l', '--length',
+                           default=25,
+                           type=int,
+                           help='Tokens per sentence')
+
+    argparser.add_argument('-s', '--support',
+                           default=5,
+                           type=int,
+                           help='Supporting patterns per candidate tuple')
+
+    argparser.add_argument('--seed',
+                           default=0,
+                           type=int,
+                           help='Random seed')
+
+    args = argparser.parse_args()
+
+    main(args)
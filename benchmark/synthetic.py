@@ -0,0 +1,104 @@
+import random
+
+from classes import classes
+from corpus import store
+
+
+TAGS = [u'PERSON', u'LOCATION', u'ORGANIZATION']
+MIDDLES = [[u'lives', u'in'],
+           [u'was', u'born', u'in'],
+           [u'moved', u'to'],
+           [u'grew', u'up', u'near']] # contexts of the planted facts
+
+
+class SyntheticCorpus:
+    """Reproducible sentence documents, shaped like
+    those of es.index_sentence. Tokens are drawn
+    from vocabulary filler words and entities of
+    the TAGS, with entity_density the chance of a
+    token being an entity. A relation_rate share
+    of the sentences state a fact PERSON -> LOCATION
+    from facts, so bootstrapping has something to
+    find."""
+
+    def __init__(self, vocabulary=1000, entities=100, entity_density=0.15, length=25, relation_rate=0.3, seed=0):
+        rng = random.Random(seed)
+
+        self.vocabulary = vocabulary
+        self.entity_density = entity_density
+        self.length = length
+        self.relation_rate = relation_rate
+        self.seed = seed
+        self.words = [u'word%d' % i for i in xrange(vocabulary)]
+        self.names = dict((tag, [u'%s_%d' % (tag.title(), i) for i in xrange(entities)]) for tag in TAGS)
+        self.facts = [(person, rng.choice(self.names[u'LOCATION'])) for person in self.names[u'PERSON']]
+
+
+    def seeds(self, count):
+        return self.facts[:count]
+
+
+    def write_seeds(self, path, count, rel=u'lives_in'):
+        with open(path, 'w') as f:
+            f.write("%s\n%s %s\n" % (rel, u'PERSON', u'LOCATION'))
+
+            for (subj, obj) in self.seeds(count):
+                f.write("%s %s\n" % (subj, obj))
+
+
+    def documents(self, count):
+        """Yields count sentence documents in (id,
+        index) order, the same ones for the same
+        parameters."""
+
+        rng = random.Random(self.seed)
+
+        for k in xrange(count):
+            length = max(3, int(rng.gauss(self.length, self.length / 4.0)))
+            pairs = []
+
+            for _ in xrange(length):
+                if rng.random() < self.entity_density:
+                    tag = rng.choice(TAGS)
+                    pairs.append((rng.choice(self.names[tag]), tag))
+                else:
+                    pairs.append((rng.choice(self.words), u'O'))
+
+            if rng.random() < self.relation_rate:
+                (subj, obj) = rng.choice(self.facts)
+                middle = rng.choice(MIDDLES)
+                fact = [(subj, u'PERSON')] + [(word, u'O') for word in middle] + [(obj, u'LOCATION')]
+                start = rng.randint(0, max(0, length - len(fact)))
+                pairs[start:start+len(fact)] = fact
+
+            tokens = [token for (token, _) in pairs]
+            entity_tags = [tag for (_, tag) in pairs]
+            tagged_tokens = [token if tag == u'O' else u'<%s>%s</%s>' % (tag, token, tag) for (token, tag) in pairs]
+
+            yield {'id': k,
+                   'index': 0,
+                   'tokens': tokens,
+                   'tagged_tokens': tagged_tokens,
+                   'entity_tags': entity_tags,
+                   'entities': list(set(entity_tags))}
+
+
+    def sentences(self, count):
+        return [classes.Sentence(doc['id'],
+                                 doc['index'],
+                                 doc['tokens'],
+                                 doc['tagged_tokens'],
+                                 doc['entity_tags'])
+                for doc in self.documents(count)]
+
+
+    def build(self, path, count):
+        """Writes count documents as a local corpus
+        at path, readable by store.CorpusStore."""
+
+        writer = store.CorpusWriter(path)
+
+        for doc in self.documents(count):
+            writer.add(doc)
+
+        writer.close()
@@ -0,0 +1,257 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from utils import io
+from classes import classes, scoring
+from benchmark import synthetic
+from config import config
+
+
+def best_time(func, repeat):
+    """Smallest wall-clock time of repeat calls of
+    func, together with its last result."""
+
+    best = None
+    result = None
+
+    for _ in xrange(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return (best, result)
+
+
+def measurement(operations, seconds, unit):
+    return {'operations': operations,
+            'seconds': seconds,
+            'unit': unit,
+            'per_second': operations / seconds if seconds > 0 else float('inf')}
+
+
+def extract(sentences):
+    raw_patterns = []
+
+    for sent in sentences:
+        raw_patterns.extend(p for (_, p) in sent.extract_candidate_tuples(u'lives_in', u'PERSON', u'LOCATION'))
+
+    return raw_patterns
+
+
+def cluster(raw_patterns):
+    clusterer = classes.SinglePassClusteringAlgorithm(raw_patterns,
+                                                      config.SNOWBALL_MIN_PATTERN_SIMILARITY)
+    clusterer.prepare()
+    clusterer.cluster()
+    return clusterer.get_snowball_patterns()
+
+
+def bench_candidate_extraction(corpus, args):
+    # fresh sentences every round, as their position caches fill up
+    rounds = [corpus.sentences(args.sentences) for _ in xrange(args.repeat)]
+    (seconds, raw_patterns) = best_time(lambda: extract(rounds.pop()), args.repeat)
+
+    return (measurement(args.sentences, seconds, 'sentences'), raw_patterns)
+
+
+def bench_context_arithmetic(raw_patterns, args):
+    contexts = [p.middle_ctx for p in raw_patterns[:args.pairs]]
+    pairs = zip(contexts, contexts[1:] + contexts[:1])
+
+    def run():
+        for (a, b) in pairs:
+            a * b
+            a + b
+
+    (seconds, _) = best_time(run, args.repeat)
+
+    return measurement(2 * len(pairs), seconds, 'operations')
+
+
+def bench_pattern_match(snowball_patterns, raw_patterns, args):
+    candidates = raw_patterns[:args.pairs]
+
+    def run():
+        for candidate in candidates:
+            for pattern in snowball_patterns:
+                pattern.match(candidate)
+
+    (seconds, _) = best_time(run, args.repeat)
+
+    return measurement(len(candidates) * len(snowball_patterns), seconds, 'matches')
+
+
+def bench_pattern_scorer(snowball_patterns, raw_patterns, args):
+    candidates = raw_patterns[:args.pairs]
+    scorer = scoring.PatternScorer(snowball_patterns)
+    (seconds, _) = best_time(lambda: scorer.score(candidates), args.repeat)
+
+    return measurement(len(candidates) * len(snowball_patterns), seconds, 'matches')
+
+
+def bench_clustering(raw_patterns, args):
+    (seconds, snowball_patterns) = best_time(lambda: cluster(raw_patterns), args.repeat)
+
+    return (measurement(len(raw_patterns), seconds, 'raw patterns'), snowball_patterns)
+
+
+def bench_full_run(corpus, args):
+    """Runs main/main.py for args.iterations over
+    a local corpus of args.run_sentences synthetic
+    sentences, in a scratch directory."""
+
+    from main import main
+
+    run_dir = tempfile.mkdtemp(prefix='snowball_benchmark_')
+    settings = ['LOGS_DIR', 'SNOWBALL_SEEDS_FILE', 'SNOWBALL_TUPLES_FILE', 'SNOWBALL_PATTERNS_FILE',
+                'SNOWBALL_CHECKPOINT_FILE', 'SNOWBALL_CORPUS_BACKEND', 'SNOWBALL_CORPUS_DIR',
+                'SNOWBALL_SENTENCE_CAP', 'SNOWBALL_NUM_ITERATIONS']
+    saved = dict((name, getattr(config, name)) for name in settings)
+
+    try:
+        corpus.build(os.path.join(run_dir, 'corpus'), args.run_sentences)
+        corpus.write_seeds(os.path.join(run_dir, 'seeds'), args.seeds)
+
+        config.LOGS_DIR = run_dir
+        config.SNOWBALL_SEEDS_FILE = os.path.join(run_dir, 'seeds')
+        config.SNOWBALL_TUPLES_FILE = os.path.join(run_dir, 'tuples')
+        config.SNOWBALL_PATTERNS_FILE = os.path.join(run_dir, 'patterns')
+        config.SNOWBALL_CHECKPOINT_FILE = os.path.join(run_dir, 'checkpoint')
+        config.SNOWBALL_CORPUS_BACKEND = 'local'
+        config.SNOWBALL_CORPUS_DIR = os.path.join(run_dir, 'corpus')
+        config.SNOWBALL_SENTENCE_CAP = args.run_sentences
+        config.SNOWBALL_NUM_ITERATIONS = args.iterations
+
+        run_args = argparse.Namespace(seeds=[config.SNOWBALL_SEEDS_FILE], resume=False, checkpoint=None)
+        start = time.time()
+        main.main(run_args)
+        seconds = time.time() - start
+
+        result = measurement(args.run_sentences, seconds, 'sentences')
+        result['tuples'] = sum(1 for _ in io.read_records(config.SNOWBALL_TUPLES_FILE))
+    finally:
+        for (name, value) in saved.items():
+            setattr(config, name, value)
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    return result
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    corpus = synthetic.SyntheticCorpus(args.vocabulary,
+                                       args.entities,
+                                       args.density,
+                                       args.length,
+                                       args.relation_rate,
+                                       args.seed)
+    results = {}
+
+    (results['candidate_extraction'], raw_patterns) = bench_candidate_extraction(corpus, args)
+    results['context_arithmetic'] = bench_context_arithmetic(raw_patterns, args)
+    (results['clustering'], snowball_patterns) = bench_clustering(raw_patterns, args)
+    results['pattern_match'] = bench_pattern_match(snowball_patterns, raw_patterns, args)
+    results['pattern_scorer'] = bench_pattern_scorer(snowball_patterns, raw_patterns, args)
+
+    if args.iterations > 0:
+        results['full_run'] = bench_full_run(corpus, args)
+
+    print "%-22s %12s %10s %14s" % ('benchmark', 'operations', 'seconds', 'per second')
+    for name in sorted(results):
+        r = results[name]
+        print "%-22s %12d %10.3f %14.1f %s/s" % (name, r['operations'], r['seconds'], r['per_second'], r['unit'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            io.save_json({'revision': revision(),
+                          'python': sys.version.split()[0],
+                          'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                          'parameters': vars(args),
+                          'results': results}, f)
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser()
+
+    argparser.add_argument('-n', '--sentences',
+                           default=2000,
+                           type=int,
+                           help='Synthetic sentences for the component benchmarks')
+
+    argparser.add_argument('-l', '--length',
+                           default=25,
+                           type=int,
+                           help='Mean tokens per sentence')
+
+    argparser.add_argument('-v', '--vocabulary',
+                           default=1000,
+                           type=int,
+                           help='Distinct filler words')
+
+    argparser.add_argument('-e', '--entities',
+                           default=100,
+                           type=int,
+                           help='Distinct entities per tag')
+
+    argparser.add_argument('-d', '--density',
+                           default=0.15,
+                           type=float,
+                           help='Chance of a token being an entity')
+
+    argparser.add_argument('--relation-rate',
+                           default=0.3,
+                           type=float,
+                           help='Share of sentences stating a planted fact')
+
+    argparser.add_argument('-p', '--pairs',
+                           default=500,
+                           type=int,
+                           help='Raw patterns used by the context and matching benchmarks')
+
+    argparser.add_argument('-i', '--iterations',
+                           default=3,
+                           type=int,
+                           help='Iterations of the full run (0 to skip it)')
+
+    argparser.add_argument('--run-sentences',
+                           default=20000,
+                           type=int,
+                           help='Sentences searched by the full run')
+
+    argparser.add_argument('--seeds',
+                           default=5,
+                           type=int,
+                           help='Seed tuples of the full run')
+
+    argparser.add_argument('-r', '--repeat',
+                           default=3,
+                           type=int,
+                           help='Rounds per benchmark; the fastest one counts')
+
+    argparser.add_argument('-o', '--output',
+                           help='File to save the results to, as JSON')
+
+    argparser.add_argument('--seed',
+                           default=0,
+                           type=int,
+                           help='Random seed')
+
+    args = argparser.parse_args()
+
+    main(args)
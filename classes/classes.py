@@ -1,12 +1,24 @@
 import math
+from array import array
+from bisect import bisect_left
 
-from utils import rgx
 from config import config
 
 
+interned_strings = {} # tags and relation names
+
+
+def intern_string(string):
+    """Like intern(), but for unicode too."""
+
+    return interned_strings.setdefault(string, string)
+
+
 ### CONTEXT #######################################################################
 
-class Context:
+class Context(object):
+    __slots__ = ('tokens', 'weight', 'ctx')
+
     def __init__(self, tokens, weight):
         self.tokens = tokens
         self.weight = weight
@@ -31,6 +43,22 @@ class Context:
             return 0.0
 
 
+    def features(self):
+        return self.ctx.keys()
+
+
+    def to_dict(self):
+        return dict(self.ctx)
+
+
+    def items(self):
+        return self.ctx.items()
+
+
+    def norm(self):
+        return math.sqrt(sum([pow(self.ctx[token], 2) for token in self.ctx]))
+
+
     def __add__(self, other):
         new_ctx = {}
         all_tokens = set(self.ctx.keys() + other.ctx.keys())
@@ -68,6 +96,8 @@ class Context:
 
 
 class AbstractContext(Context):
+    __slots__ = ()
+
     def __init__(self, ctx):
         self.ctx = ctx
 
@@ -80,14 +110,317 @@ class AbstractContext(Context):
         return "AbstractContext(ctx=%r)" % self.ctx
 
 
+class Vocabulary(object):
+    __slots__ = ('ids', 'tokens')
+
+    def __init__(self):
+        self.ids = {}
+        self.tokens = []
+
+
+    def intern(self, token):
+        if token in self.ids:
+            return self.ids[token]
+
+        token_id = len(self.tokens)
+        self.ids[token] = token_id
+        self.tokens.append(token)
+
+        return token_id
+
+
+    def lookup(self, token):
+        return self.ids.get(token)
+
+
+    def restore(self, other):
+        # in place, since contexts refer to the module vocabulary
+        self.ids = other.ids
+        self.tokens = other.tokens
+
+
+    def token(self, token_id):
+        return self.tokens[token_id]
+
+
+    def __len__(self):
+        return len(self.tokens)
+
+
+vocabulary = Vocabulary() # shared by every sparse context of a run
+
+
+class SparseContext(Context):
+    """Context stored as parallel arrays of
+    sorted token ids and weights, where ids
+    come from the run-wide vocabulary."""
+
+    __slots__ = ('ids', 'vals')
+
+    def __init__(self, tokens, weight):
+        self.tokens = tokens
+        self.weight = weight
+        counts = {}
+
+        for token in self.tokens:
+            token_id = vocabulary.intern(token)
+            if token_id in counts:
+                counts[token_id] += 1
+            else:
+                counts[token_id] = 1.0
+
+        self.ids = array('l', sorted(counts))
+        norm = math.sqrt(sum([pow(counts[token_id], 2) for token_id in self.ids]))
+        self.vals = array('d', [weight * (counts[token_id] / norm) for token_id in self.ids])
+
+
+    def get(self, token_id):
+        i = bisect_left(self.ids, token_id)
+
+        if i != len(self.ids) and self.ids[i] == token_id:
+            return self.vals[i]
+        else:
+            return 0.0
+
+
+    def __getitem__(self, key):
+        token_id = vocabulary.lookup(key)
+
+        if token_id is None:
+            return 0.0
+        else:
+            return self.get(token_id)
+
+
+    def features(self):
+        return self.ids
+
+
+    def items(self):
+        return zip(self.ids, self.vals)
+
+
+    def norm(self):
+        return math.sqrt(sum([pow(val, 2) for val in self.vals]))
+
+
+    def to_dict(self):
+        return dict((vocabulary.token(self.ids[i]), self.vals[i]) for i in xrange(len(self.ids)))
+
+
+    def __add__(self, other):
+        ids = array('l')
+        vals = array('d')
+        a_ids, a_vals = self.ids, self.vals
+        b_ids, b_vals = other.ids, other.vals
+        n, m = len(a_ids), len(b_ids)
+        i = j = 0
+
+        while i < n and j < m:
+            if a_ids[i] == b_ids[j]:
+                ids.append(a_ids[i])
+                vals.append(a_vals[i] + b_vals[j])
+                i += 1
+                j += 1
+            elif a_ids[i] < b_ids[j]:
+                ids.append(a_ids[i])
+                vals.append(a_vals[i])
+                i += 1
+            else:
+                ids.append(b_ids[j])
+                vals.append(b_vals[j])
+                j += 1
+
+        ids.extend(a_ids[i:])
+        vals.extend(a_vals[i:])
+        ids.extend(b_ids[j:])
+        vals.extend(b_vals[j:])
+
+        return AbstractSparseContext(ids, vals)
+
+
+    def __mul__(self, other):
+        total = 0.0
+        a_ids, a_vals = self.ids, self.vals
+
+        if not isinstance(other, SparseContext):
+            for i in xrange(len(a_ids)):
+                total += a_vals[i] * other.get(a_ids[i])
+
+            return total
+
+        b_ids, b_vals = other.ids, other.vals
+        n, m = len(a_ids), len(b_ids)
+        i = j = 0
+
+        while i < n and j < m:
+            if a_ids[i] == b_ids[j]:
+                total += a_vals[i] * b_vals[j]
+                i += 1
+                j += 1
+            elif a_ids[i] < b_ids[j]:
+                i += 1
+            else:
+                j += 1
+
+        return total
+
+
+    def __div__(self, factor):
+        vals = array('d', [val / factor for val in self.vals])
+
+        return AbstractSparseContext(self.ids, vals)
+
+
+    def __getstate__(self):
+        # ids are only meaningful to this process' vocabulary
+        return {'tokens': self.tokens, 'weight': self.weight}
+
+
+    def __setstate__(self, state):
+        self.__init__(state['tokens'], state['weight'])
+
+
+    def __eq__(self, other):
+        return isinstance(other, SparseContext) and self.tokens == other.tokens and self.weight == other.weight
+
+
+    def __repr__(self):
+        return "SparseContext(tokens=%r, weight=%r)" % (self.tokens, self.weight)
+
+
+class AbstractSparseContext(SparseContext):
+    __slots__ = ()
+
+    def __init__(self, ids, vals):
+        self.ids = ids
+        self.vals = vals
+
+
+    @classmethod
+    def from_ctx(cls, ctx):
+        items = sorted((vocabulary.intern(token), ctx[token]) for token in ctx)
+
+        return cls(array('l', [token_id for (token_id, _) in items]),
+                   array('d', [val for (_, val) in items]))
+
+
+    def __getstate__(self):
+        return {'ctx': self.to_dict()}
+
+
+    def __setstate__(self, state):
+        other = AbstractSparseContext.from_ctx(state['ctx'])
+        self.ids = other.ids
+        self.vals = other.vals
+
+
+    def __eq__(self, other):
+        return isinstance(other, AbstractSparseContext) and self.ids == other.ids and self.vals == other.vals
+
+
+    def __repr__(self):
+        return "AbstractSparseContext.from_ctx(%r)" % self.to_dict()
+
+
+def create_context(tokens, weight):
+    if config.SNOWBALL_SPARSE_CONTEXTS:
+        return SparseContext(tokens, weight)
+    else:
+        return Context(tokens, weight)
+
+
+class CentroidContext(Context):
+    """Running sum of member contexts which
+    reads as their average, keyed by the
+    features of the members (tokens or
+    vocabulary ids)."""
+
+    __slots__ = ('sums', 'count', 'sparse')
+
+    def __init__(self):
+        self.sums = {}
+        self.count = 0
+        self.sparse = False
+
+
+    def add(self, ctx):
+        """Adds a member context and returns
+        the features it introduced."""
+
+        new_features = []
+        self.count += 1
+        self.sparse = isinstance(ctx, SparseContext)
+
+        for (feature, val) in ctx.items():
+            if feature in self.sums:
+                self.sums[feature] += val
+            else:
+                self.sums[feature] = val
+                new_features.append(feature)
+
+        return new_features
+
+
+    def get(self, feature):
+        if feature in self.sums:
+            return self.sums[feature] / self.count
+        else:
+            return 0.0
+
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+
+    def features(self):
+        return self.sums.keys()
+
+
+    def items(self):
+        return [(feature, self.sums[feature] / self.count) for feature in self.sums]
+
+
+    def norm(self):
+        return math.sqrt(sum([pow(val, 2) for (_, val) in self.items()]))
+
+
+    def __mul__(self, other):
+        total = 0.0
+
+        for (feature, val) in other.items():
+            total += self.get(feature) * val
+
+        return total
+
+
+    def materialize(self):
+        if self.sparse:
+            ids = sorted(self.sums)
+            return AbstractSparseContext(array('l', ids),
+                                         array('d', [self.sums[token_id] / self.count for token_id in ids]))
+        else:
+            return AbstractContext(dict(self.items()))
+
+
+    def __eq__(self, other):
+        return isinstance(other, CentroidContext) and self.sums == other.sums and self.count == other.count
+
+
+    def __repr__(self):
+        return "CentroidContext(sums=%r, count=%r)" % (self.sums, self.count)
+
+
 ### PATTERN #######################################################################
 
-class Pattern:
+class Pattern(object):
+    __slots__ = ('left_ctx', 'tag_one', 'middle_ctx', 'tag_two', 'right_ctx')
+
     def __init__(self, left_ctx, tag_one, middle_ctx, tag_two, right_ctx):
         self.left_ctx = left_ctx
-        self.tag_one = tag_one
+        self.tag_one = intern_string(tag_one)
         self.middle_ctx = middle_ctx
-        self.tag_two = tag_two
+        self.tag_two = intern_string(tag_two)
         self.right_ctx = right_ctx
 
 
@@ -151,7 +484,60 @@ class Pattern:
                                                                                               self.right_ctx)
 
 
+class PatternCentroid(object):
+    """Running left/middle/right sums of the
+    patterns added to it. Adding a member costs
+    the size of its contexts; view() reads the
+    current average without copying it."""
+
+    __slots__ = ('tag_one', 'tag_two', 'left_ctx', 'middle_ctx', 'right_ctx', 'count')
+
+    def __init__(self, patterns=[]):
+        self.tag_one = None
+        self.tag_two = None
+        self.left_ctx = CentroidContext()
+        self.middle_ctx = CentroidContext()
+        self.right_ctx = CentroidContext()
+        self.count = 0
+
+        for pattern in patterns:
+            self.add(pattern)
+
+
+    def add(self, pattern):
+        """Adds pattern and returns the middle
+        features it introduced."""
+
+        if self.count == 0:
+            self.tag_one = pattern.tag_one
+            self.tag_two = pattern.tag_two
+
+        self.count += 1
+        self.left_ctx.add(pattern.left_ctx)
+        self.right_ctx.add(pattern.right_ctx)
+
+        return self.middle_ctx.add(pattern.middle_ctx)
+
+
+    def view(self):
+        return Pattern(self.left_ctx,
+                       self.tag_one,
+                       self.middle_ctx,
+                       self.tag_two,
+                       self.right_ctx)
+
+
+    def materialize(self):
+        return Pattern(self.left_ctx.materialize(),
+                       self.tag_one,
+                       self.middle_ctx.materialize(),
+                       self.tag_two,
+                       self.right_ctx.materialize())
+
+
 class RawPattern(Pattern):
+    __slots__ = ('page', 'index')
+
     def __init__(self, left_ctx, tag_one, middle_ctx, tag_two, right_ctx, page, index):
         Pattern.__init__(self, left_ctx, tag_one, middle_ctx, tag_two, right_ctx)
         self.page = page
@@ -173,8 +559,13 @@ class RawPattern(Pattern):
 
 
 class SnowballPattern(Pattern):
-    def __init__(self, support, pos, neg, update_factor=config.SNOWBALL_PATTERN_CONFIDENCE_UPDATE_FACTOR, old_conf=1.0):
-        avg_pattern = sum(support) / len(support)
+    __slots__ = ('support', 'pos', 'neg', 'update_factor', 'old_conf')
+
+    def __init__(self, support, pos, neg, update_factor=config.SNOWBALL_PATTERN_CONFIDENCE_UPDATE_FACTOR, old_conf=1.0, centroid=None):
+        if centroid is None:
+            centroid = PatternCentroid(support)
+
+        avg_pattern = centroid.materialize()
 
         Pattern.__init__(self,
                          avg_pattern.left_ctx,
@@ -206,14 +597,34 @@ class SnowballPattern(Pattern):
 
     
     def update_confidence(self, tup, tuples):
-        self.old_conf = self.confidence()
+        if not isinstance(tuples, SeedIndex):
+            tuples = SeedIndex(tuples)
+
+        self.add_evidence([tuples.evidence(tup)])
+
+
+    def add_evidence(self, evidence):
+        """Applies a batch of (pos, neg) counts,
+        one confidence update per entry, in order."""
 
-        for t in tuples:
-            if tup.subj == t.subj:
-                if tup.obj == t.obj:
-                    self.pos += 1
-                else:
-                    self.neg += 1
+        for (pos, neg) in evidence:
+            self.old_conf = self.confidence()
+            self.pos += pos
+            self.neg += neg
+
+
+    def to_record(self):
+        return {u'type': u'pattern',
+                u'tag_one': self.tag_one,
+                u'tag_two': self.tag_two,
+                u'left': self.left_ctx.to_dict(),
+                u'middle': self.middle_ctx.to_dict(),
+                u'right': self.right_ctx.to_dict(),
+                u'pos': self.pos,
+                u'neg': self.neg,
+                u'update_factor': self.update_factor,
+                u'old_conf': self.old_conf,
+                u'support': [[p.page, p.index] for p in self.support]}
 
 
     def __eq__(self, other):
@@ -228,15 +639,77 @@ class SnowballPattern(Pattern):
                                                                                                self.old_conf)
 
 
+class PatternStore(object):
+    """Snowball patterns partitioned by their
+    ordered (tag_one, tag_two) pair, since a
+    pattern never matches another tag pair."""
+
+    __slots__ = ('patterns', 'partitions', 'stats')
+
+    def __init__(self, patterns=[]):
+        self.patterns = []
+        self.partitions = {}
+        self.stats = {}
+
+        self.extend(patterns)
+
+
+    def add(self, pattern):
+        tags = (pattern.tag_one, pattern.tag_two)
+        self.patterns.append(pattern)
+        self.partitions.setdefault(tags, []).append(pattern)
+
+
+    def extend(self, patterns):
+        for pattern in patterns:
+            self.add(pattern)
+
+
+    def tag_pairs(self):
+        return sorted(self.partitions)
+
+
+    def partition(self, tag_one, tag_two):
+        return self.partitions.get((tag_one, tag_two), [])
+
+
+    def record(self, tags, candidates, matches):
+        """Adds to the matching statistics of
+        the partition for tags."""
+
+        stats = self.stats.setdefault(tags, {u'candidates': 0,
+                                             u'matches': 0})
+        stats[u'candidates'] += candidates
+        stats[u'matches'] += matches
+
+
+    def reset_stats(self):
+        self.stats = {}
+
+
+    def __iter__(self):
+        return iter(self.patterns)
+
+
+    def __len__(self):
+        return len(self.patterns)
+
+
+    def __repr__(self):
+        return "PatternStore(patterns=%r)" % self.patterns
+
+
 ### TUPLE #########################################################################
 
-class Tuple:
+class Tuple(object):
+    __slots__ = ('rel', 'subj', 'obj', 'subj_tag', 'obj_tag')
+
     def __init__(self, rel, subj, obj, subj_tag, obj_tag):
-        self.rel = rel
+        self.rel = intern_string(rel)
         self.subj = subj
         self.obj = obj
-        self.subj_tag = subj_tag
-        self.obj_tag = obj_tag
+        self.subj_tag = intern_string(subj_tag)
+        self.obj_tag = intern_string(obj_tag)
 
 
     def as_tuple(self):
@@ -255,6 +728,15 @@ class Tuple:
                                  self.obj_tag)
 
 
+    def to_record(self):
+        return {u'type': u'tuple',
+                u'rel': self.rel,
+                u'subj': self.subj,
+                u'obj': self.obj,
+                u'subj_tag': self.subj_tag,
+                u'obj_tag': self.obj_tag}
+
+
     def __eq__(self, other):
         return isinstance(other, Tuple) and self.rel == other.rel and self.subj == other.subj and self.obj == other.obj and self.subj_tag == other.subj_tag and self.obj_tag == other.obj_tag
 
@@ -276,15 +758,25 @@ class Tuple:
 
 
 class CandidateTuple(Tuple):
-    def __init__(self, rel, subj, obj, subj_tag, obj_tag, conf, update_factor=config.SNOWBALL_TUPLE_CONFIDENCE_UPDATE_FACTOR, patterns=None):
+    __slots__ = ('conf', 'update_factor', 'provenance')
+
+    def __init__(self, rel, subj, obj, subj_tag, obj_tag, conf, update_factor=config.SNOWBALL_TUPLE_CONFIDENCE_UPDATE_FACTOR, provenance=None):
         Tuple.__init__(self, rel, subj, obj, subj_tag, obj_tag)
         self.conf = conf
         self.update_factor = update_factor
-        self.patterns = patterns if patterns else []
+        self.provenance = array('l') # flattened (page, index) pairs of supporting sentences
+
+        for (page, index) in (provenance if provenance else []):
+            self.add_provenance(page, index)
+
+
+    def add_provenance(self, page, index):
+        self.provenance.append(page)
+        self.provenance.append(index)
 
 
     def add_pattern(self, pattern):
-        self.patterns.append(pattern)
+        self.add_provenance(pattern.page, pattern.index)
 
 
     def add_patterns(self, patterns):
@@ -292,6 +784,10 @@ class CandidateTuple(Tuple):
             self.add_pattern(p)
 
 
+    def get_provenance(self):
+        return [(self.provenance[k], self.provenance[k+1]) for k in xrange(0, len(self.provenance), 2)]
+
+
     def confidence(self):
         return self.conf
 
@@ -308,37 +804,125 @@ class CandidateTuple(Tuple):
         self.conf = self.update_factor*new_conf + (1-self.update_factor)*self.conf
 
 
+    def to_record(self):
+        record = Tuple.to_record(self)
+        record[u'conf'] = self.conf
+        record[u'update_factor'] = self.update_factor
+        record[u'provenance'] = [list(pair) for pair in self.get_provenance()]
+
+        return record
+
+
     def __eq__(self, other):
         return isinstance(other, CandidateTuple) and self.rel == other.rel and self.subj == other.subj and self.obj == other.obj and self.subj_tag == other.subj_tag and self.obj_tag == other.obj_tag and self.conf == other.conf and self.update_factor == other.update_factor
 
 
     def __repr__(self):
-        return "CandidateTuple(rel=%r, subj=%r, obj=%r, subj_tag=%r, obj_tag=%r, conf=%r, update_factor=%r, patterns=%r)" % (self.rel,
-                                                                                                                             self.subj,
-                                                                                                                             self.obj,
-                                                                                                                             self.subj_tag,
-                                                                                                                             self.obj_tag,
-                                                                                                                             self.conf,
-                                                                                                                             self.update_factor,
-                                                                                                                             self.patterns)
+        return "CandidateTuple(rel=%r, subj=%r, obj=%r, subj_tag=%r, obj_tag=%r, conf=%r, update_factor=%r, provenance=%r)" % (self.rel,
+                                                                                                                               self.subj,
+                                                                                                                               self.obj,
+                                                                                                                               self.subj_tag,
+                                                                                                                               self.obj_tag,
+                                                                                                                               self.conf,
+                                                                                                                               self.update_factor,
+                                                                                                                               self.get_provenance())
+
+
+class SeedIndex(object):
+    """Maps each seed subject to the number of
+    times each object is known for it, so the
+    evidence for a candidate is a lookup."""
+
+    __slots__ = ('objects', 'totals')
+
+    def __init__(self, tuples=[]):
+        self.objects = {}
+        self.totals = {}
+
+        for tup in tuples:
+            self.add(tup)
+
+
+    def add(self, tup):
+        objects = self.objects.setdefault(tup.subj, {})
+        objects[tup.obj] = objects.get(tup.obj, 0) + 1
+        self.totals[tup.subj] = self.totals.get(tup.subj, 0) + 1
+
+
+    def evidence(self, tup):
+        """Returns the (pos, neg) counts for tup: seeds
+        with its subject and object, and seeds with
+        its subject but another object."""
+
+        if tup.subj not in self.objects:
+            return (0, 0)
+
+        pos = self.objects[tup.subj].get(tup.obj, 0)
+
+        return (pos, self.totals[tup.subj] - pos)
+
+
+    def evidence_batch(self, tuples):
+        return [self.evidence(tup) for tup in tuples]
 
 
 ### SENTENCE ######################################################################
 
-class Sentence:
-    def __init__(self, page, index, tokens, tagged_tokens):
+def entity_tag(tagged_token):
+    """Returns TAG for a token of the form
+    <TAG>string</TAG>, or u'O' otherwise."""
+
+    if tagged_token.startswith(u'<') and tagged_token.endswith(u'>'):
+        close = tagged_token.find(u'>')
+        tag = tagged_token[1:close]
+
+        if len(tagged_token) >= 2*len(tag) + 5 and tagged_token.endswith(u'</%s>' % tag):
+            return tag
+
+    return u'O'
+
+
+class Sentence(object):
+    __slots__ = ('page', 'index', 'tokens', 'tagged_tokens', 'entity_tags', 'pieces', 'offsets', 'positions_by_tag', 'positions_by_string')
+
+    def __init__(self, page, index, tokens, tagged_tokens, entity_tags=None):
         self.page = page
         self.index = index
         self.tokens = tokens
         self.tagged_tokens = tagged_tokens
+        self.entity_tags = entity_tags
+        self.pieces = None
+        self.offsets = None
+        self.positions_by_tag = None
+        self.positions_by_string = None
+
+
+    def index_positions(self):
+        """Maps entity tags and tagged strings to their
+        token positions, using the entity tags stored
+        with the sentence when there are any."""
+
+        if self.positions_by_tag is None:
+            self.positions_by_tag = {}
+            self.positions_by_string = {}
+            entity_tags = self.entity_tags
+
+            if entity_tags is None:
+                entity_tags = [entity_tag(tagged_token) for tagged_token in self.tagged_tokens]
+
+            for i in xrange(len(self.tagged_tokens)):
+                if entity_tags[i] != u'O':
+                    self.positions_by_tag.setdefault(entity_tags[i], []).append(i)
+                    self.positions_by_string.setdefault(self.tagged_tokens[i], []).append(i)
+
+        return (self.positions_by_tag, self.positions_by_string)
 
     
     def index_combinations_by_tuple(self, tup):
         combos = []
-        s1 = tup.subj_string()
-        s2 = tup.obj_string()
-        indices1 = [i for i in xrange(len(self.tagged_tokens)) if self.tagged_tokens[i] == s1]
-        indices2 = [i for i in xrange(len(self.tagged_tokens)) if self.tagged_tokens[i] == s2]
+        (_, positions_by_string) = self.index_positions()
+        indices1 = positions_by_string.get(tup.subj_string(), [])
+        indices2 = positions_by_string.get(tup.obj_string(), [])
 
         for i1 in indices1:
             for i2 in indices2:
@@ -350,10 +934,9 @@ class Sentence:
     
     def index_combinations_by_tags(self, subj_tag, obj_tag):
         combos = []
-        r1 = rgx.create_template_rgx(subj_tag)
-        r2 = rgx.create_template_rgx(obj_tag)
-        indices1 = [i for i in xrange(len(self.tagged_tokens)) if r1.match(self.tagged_tokens[i])]
-        indices2 = [i for i in xrange(len(self.tagged_tokens)) if r2.match(self.tagged_tokens[i])]
+        (positions_by_tag, _) = self.index_positions()
+        indices1 = positions_by_tag.get(subj_tag, [])
+        indices2 = positions_by_tag.get(obj_tag, [])
 
         for i1 in indices1:
             for i2 in indices2:
@@ -372,29 +955,49 @@ class Sentence:
         return new_tokens
 
 
+    def split_tokens(self):
+        """Splits the tokens on underscores once.
+        Returns the pieces and the offset table, where
+        the pieces of token k are pieces[offsets[k]:offsets[k+1]]."""
+
+        if self.pieces is None:
+            self.pieces = []
+            self.offsets = [0]
+
+            for token in self.tokens:
+                self.pieces.extend(token.split(u'_'))
+                self.offsets.append(len(self.pieces))
+
+        return (self.pieces, self.offsets)
+
+
+    def create_raw_pattern(self, i1, i2, subj_tag, obj_tag):
+        """Builds the pattern around the entities at
+        positions i1 (subject) and i2 (object) from
+        slices of the cached pieces."""
+
+        (pieces, offsets) = self.split_tokens()
+        i = i1 if i1 < i2 else i2
+        j = i2 if i1 < i2 else i1
+        tag_one = subj_tag if i1 < i2 else obj_tag
+        tag_two = obj_tag if i1 < i2 else subj_tag
+
+        left = pieces[max(offsets[i] - config.SNOWBALL_LR_MAX_WINDOW, 0):offsets[i]]
+        middle = pieces[offsets[i+1]:offsets[j]]
+        right = pieces[offsets[j+1]:offsets[j+1] + config.SNOWBALL_LR_MAX_WINDOW]
+        left_ctx = create_context(left, config.SNOWBALL_LEFT_CTX_WEIGHT)
+        middle_ctx = create_context(middle, config.SNOWBALL_MIDDLE_CTX_WEIGHT)
+        right_ctx = create_context(right, config.SNOWBALL_RIGHT_CTX_WEIGHT)
+
+        return RawPattern(left_ctx, tag_one, middle_ctx, tag_two, right_ctx, self.page, self.index)
+
+
     def extract_raw_patterns(self, tup):
         patterns = []
         combos = self.index_combinations_by_tuple(tup)
 
         for (i1, i2) in combos:
-            i = i1 if i1 < i2 else i2
-            j = i2 if i1 < i2 else i1
-            tag_one = tup.subj_tag if i1 < i2 else tup.obj_tag
-            tag_two = tup.obj_tag if i1 < i2 else tup.subj_tag
-
-            left = self.tokens[:i]
-            middle = self.tokens[i+1:j]
-            right = self.tokens[j+1:]
-            left_ctx = Context(self.preprocess_tokens(left)[-config.SNOWBALL_LR_MAX_WINDOW:],
-                               config.SNOWBALL_LEFT_CTX_WEIGHT)
-            middle_ctx = Context(self.preprocess_tokens(middle),
-                                 config.SNOWBALL_MIDDLE_CTX_WEIGHT)
-            right_ctx = Context(self.preprocess_tokens(right)[:config.SNOWBALL_LR_MAX_WINDOW],
-                                config.SNOWBALL_RIGHT_CTX_WEIGHT)
-
-            pattern = RawPattern(left_ctx, tag_one, middle_ctx, tag_two, right_ctx, self.page, self.index)
-
-            patterns.append(pattern)
+            patterns.append(self.create_raw_pattern(i1, i2, tup.subj_tag, tup.obj_tag))
 
         return patterns
 
@@ -404,22 +1007,7 @@ class Sentence:
         combos = self.index_combinations_by_tags(subj_tag, obj_tag)
 
         for (i1, i2) in combos:
-            i = i1 if i1 < i2 else i2
-            j = i2 if i1 < i2 else i1
-            tag_one = subj_tag if i1 < i2 else obj_tag
-            tag_two = obj_tag if i1 < i2 else subj_tag
-
-            left = self.tokens[:i]
-            middle = self.tokens[i+1:j]
-            right = self.tokens[j+1:]
-            left_ctx = Context(self.preprocess_tokens(left)[-config.SNOWBALL_LR_MAX_WINDOW:],
-                               config.SNOWBALL_LEFT_CTX_WEIGHT)
-            middle_ctx = Context(self.preprocess_tokens(middle),
-                                 config.SNOWBALL_MIDDLE_CTX_WEIGHT)
-            right_ctx = Context(self.preprocess_tokens(right)[:config.SNOWBALL_LR_MAX_WINDOW],
-                                config.SNOWBALL_RIGHT_CTX_WEIGHT)
-
-            pattern = RawPattern(left_ctx, tag_one, middle_ctx, tag_two, right_ctx, self.page, self.index)
+            pattern = self.create_raw_pattern(i1, i2, subj_tag, obj_tag)
 
             subj = self.tokens[i1]
             obj = self.tokens[i2]
@@ -428,7 +1016,6 @@ class Sentence:
             candidates.append((tup, pattern))
 
         return candidates
-            
 
 
     def __eq__(self, other):
@@ -444,39 +1031,117 @@ class Sentence:
 
 ### CLUSTERING ####################################################################
 
-class SinglePassClusteringAlgorithm:
-    def __init__(self, patterns, threshold):
+class SinglePassClusteringAlgorithm(object):
+    def __init__(self, patterns, threshold, refresh=config.SNOWBALL_REFRESH_CLUSTER_REP):
         self.patterns = patterns
         self.threshold = threshold
+        self.refresh = refresh # keep each rep at the running centroid of its cluster
         self.clusters = []
+        self.tag_clusters = {} # (tag_one, tag_two) -> cluster positions
+        self.index = {} # (tag_one, tag_two, middle feature) -> cluster positions
+        self.max_norms = {} # (tag_one, tag_two) -> longest left/right member contexts
+        self.comparisons = 0 # pattern/cluster similarities computed
         
 
     def calculate_rep(self, members):
-        return sum(members) / len(members)
+        return PatternCentroid(members).materialize()
+
+
+    def add_cluster(self, pattern):
+        new_cluster = {}
+        new_cluster[u'members'] = [pattern]
+        new_cluster[u'centroid'] = PatternCentroid([pattern])
+        if self.refresh:
+            new_cluster[u'rep'] = new_cluster[u'centroid'].view()
+        else:
+            new_cluster[u'rep'] = new_cluster[u'centroid'].materialize()
+        self.clusters.append(new_cluster)
+        self.index_cluster(len(self.clusters) - 1)
+        self.update_norms(pattern)
+
+
+    def add_member(self, position, pattern):
+        cluster = self.clusters[position]
+        cluster[u'members'].append(pattern)
+        new_features = cluster[u'centroid'].add(pattern)
+
+        if self.refresh:
+            tags = (pattern.tag_one, pattern.tag_two)
+            for feature in new_features:
+                self.index.setdefault(tags + (feature,), []).append(position)
+
+        self.update_norms(pattern)
+
+
+    def index_cluster(self, position):
+        rep = self.clusters[position][u'rep']
+        tags = (rep.tag_one, rep.tag_two)
+
+        self.tag_clusters.setdefault(tags, []).append(position)
+
+        for feature in rep.middle_ctx.features():
+            self.index.setdefault(tags + (feature,), []).append(position)
+
+
+    def update_norms(self, pattern):
+        # a centroid is never longer than its longest member
+        tags = (pattern.tag_one, pattern.tag_two)
+        (left_norm, right_norm) = self.max_norms.get(tags, (0.0, 0.0))
+        self.max_norms[tags] = (max(left_norm, pattern.left_ctx.norm()),
+                                max(right_norm, pattern.right_ctx.norm()))
+
+
+    def candidate_clusters(self, pattern):
+        """Returns the positions of the clusters
+        that could match pattern at or above the
+        threshold, in creation order. A cluster
+        sharing no middle feature with pattern
+        scores at most the left/right bound below
+        (Cauchy-Schwarz), so it is skipped unless
+        that bound reaches the threshold."""
+
+        tags = (pattern.tag_one, pattern.tag_two)
+        (left_norm, right_norm) = self.max_norms.get(tags, (0.0, 0.0))
+        bound = pattern.left_ctx.norm() * left_norm + pattern.right_ctx.norm() * right_norm
+
+        if bound + 1e-9 >= self.threshold: # slack for rounding in the dot products
+            return self.tag_clusters.get(tags, [])
+
+        positions = set()
+
+        for feature in pattern.middle_ctx.features():
+            positions.update(self.index.get(tags + (feature,), []))
+
+        return sorted(positions)
 
 
     def prepare(self):
         if len(self.patterns) != 0:
-            first_cluster = {}
-            first_cluster[u'members'] = [self.patterns[0]]
-            first_cluster[u'rep'] = self.calculate_rep(first_cluster['members'])
-            self.clusters.append(first_cluster)
+            self.add_cluster(self.patterns[0])
             self.patterns = self.patterns[1:]
 
 
     def cluster(self):
         for pattern in self.patterns:
-            cluster_matches = map(lambda c: (pattern.match(c['rep']), c),
-                                  self.clusters)
-            best_cluster_match = max(cluster_matches,
-                                     key=lambda m: m[0])
-            if best_cluster_match[0] >= self.threshold:
-                best_cluster_match[1]['members'].append(pattern)
+            best_cluster_match = (0.0, None)
+
+            positions = self.candidate_clusters(pattern)
+            self.comparisons += len(positions)
+
+            # first cluster with the highest similarity, as max() would pick
+            for position in positions:
+                similarity = pattern.match(self.clusters[position]['rep'])
+                if best_cluster_match[1] is None or similarity > best_cluster_match[0]:
+                    best_cluster_match = (similarity, position)
+
+            if best_cluster_match[1] is not None and best_cluster_match[0] >= self.threshold:
+                self.add_member(best_cluster_match[1], pattern)
             else:
-                new_cluster = {}
-                new_cluster[u'members'] = [pattern]
-                new_cluster[u'rep'] = self.calculate_rep(new_cluster[u'members'])
-                self.clusters.append(new_cluster)
+                self.add_cluster(pattern)
+
+
+    def partition_sizes(self):
+        return dict((tags, len(positions)) for (tags, positions) in self.tag_clusters.items())
 
 
     def get_snowball_patterns(self):
@@ -487,7 +1152,8 @@ class SinglePassClusteringAlgorithm:
                 pattern = SnowballPattern(cluster['members'],
                                           len(cluster['members']),
                                           0,
-                                          config.SNOWBALL_PATTERN_CONFIDENCE_UPDATE_FACTOR)
+                                          config.SNOWBALL_PATTERN_CONFIDENCE_UPDATE_FACTOR,
+                                          centroid=cluster['centroid'])
                 
                 snowball_patterns.append(pattern)
 
@@ -1,30 +1,53 @@
-from classes import *
+import argparse
+
 from utils import io
 from config import config
 
 
-def read_tuples():
-    pairs = []
-    f = open(config.SNOWBALL_TUPLES_FILE)
-    strings = f.readlines()
-    f.close()
+def stream_tuples(path=config.SNOWBALL_TUPLES_FILE, min_conf=None, rel=None):
+    """Lazily yields the tuple records of path,
+    keeping those with at least min_conf
+    confidence and relation rel, if given."""
+
+    for record in io.read_records(path):
+        if record[u'type'] != u'tuple':
+            continue
+        if min_conf is not None and record[u'conf'] < min_conf:
+            continue
+        if rel is not None and record[u'rel'] != rel:
+            continue
 
-    for line in strings:
-        o = eval(io.to_unicode(line))
-        
-        if type(o) is not str:
-            pair = u"%s\t%s" % (o.subj, o.obj)
-            pairs.append(io.to_string(pair))
+        yield record
 
-    return pairs
 
+def read_tuples(path=config.SNOWBALL_TUPLES_FILE, min_conf=None, rel=None):
+    for record in stream_tuples(path, min_conf, rel):
+        pair = u"%s\t%s" % (record[u'subj'], record[u'obj'])
+        yield io.to_string(pair)
 
-def main():
-    pairs = read_tuples()
 
-    for pair in pairs:
+def main(args):
+    for pair in read_tuples(args.file, args.min_conf, args.rel):
         print pair
 
 
 if __name__ == '__main__':
-    main()
+    argparser = argparse.ArgumentParser()
+
+    argparser.add_argument('-f', '--file',
+                           default=config.SNOWBALL_TUPLES_FILE,
+                           help='Tuples file to read')
+
+    argparser.add_argument('-c', '--min-conf',
+                           type=float,
+                           help='Only tuples with at least this confidence')
+
+    argparser.add_argument('-r', '--rel',
+                           help='Only tuples of this relation')
+
+    args = argparser.parse_args()
+
+    if args.rel:
+        args.rel = io.to_unicode(args.rel)
+
+    main(args)
@@ -0,0 +1,265 @@
+from __future__ import absolute_import
+
+import random
+
+import numpy as np
+from scipy import sparse
+
+from classes import classes
+from config import config
+
+
+def context_arrays(ctx):
+    """Returns the (token ids, weights) of a
+    context, interning dictionary-backed
+    contexts into the run-wide vocabulary."""
+
+    if isinstance(ctx, classes.SparseContext):
+        return (ctx.ids, ctx.vals)
+
+    items = sorted((classes.vocabulary.intern(token), ctx.ctx[token]) for token in ctx.ctx)
+
+    return ([token_id for (token_id, _) in items],
+            [val for (_, val) in items])
+
+
+def pack_contexts(contexts, width):
+    """Packs contexts into the rows of a sparse
+    matrix with one column per vocabulary id.
+    Ids beyond width are dropped since no
+    packed pattern can share them."""
+
+    data = []
+    indices = []
+    indptr = [0]
+
+    for ctx in contexts:
+        (ids, vals) = context_arrays(ctx)
+
+        for k in xrange(len(ids)):
+            if ids[k] < width:
+                indices.append(ids[k])
+                data.append(vals[k])
+
+        indptr.append(len(indices))
+
+    return sparse.csr_matrix((np.array(data, dtype=np.float64),
+                              np.array(indices, dtype=np.int64),
+                              np.array(indptr, dtype=np.int64)),
+                             shape=(len(indptr) - 1, width))
+
+
+class PatternScorer:
+    """Scores batches of raw patterns against
+    a fixed list of snowball patterns with one
+    sparse matrix product per context."""
+
+    def __init__(self, patterns, threshold=config.SNOWBALL_MIN_PATTERN_SIMILARITY):
+        self.patterns = patterns
+        self.threshold = threshold
+        self.comparisons = 0 # (candidate, pattern) similarities computed
+        self.tags = [(p.tag_one, p.tag_two) for p in patterns]
+        self.tag_masks = {}
+
+        # make sure every token is interned before fixing the width
+        for p in patterns:
+            for ctx in (p.left_ctx, p.middle_ctx, p.right_ctx):
+                context_arrays(ctx)
+
+        self.width = len(classes.vocabulary)
+        self.left = pack_contexts([p.left_ctx for p in patterns], self.width).T.tocsr()
+        self.middle = pack_contexts([p.middle_ctx for p in patterns], self.width).T.tocsr()
+        self.right = pack_contexts([p.right_ctx for p in patterns], self.width).T.tocsr()
+
+
+    def tag_mask(self, tag_one, tag_two):
+        key = (tag_one, tag_two)
+
+        if key not in self.tag_masks:
+            self.tag_masks[key] = np.array([tags == key for tags in self.tags], dtype=bool)
+
+        return self.tag_masks[key]
+
+
+    def similarities(self, candidates):
+        """Returns the dense (candidates x patterns)
+        matrix of Pattern.match scores."""
+
+        left = pack_contexts([c.left_ctx for c in candidates], self.width)
+        middle = pack_contexts([c.middle_ctx for c in candidates], self.width)
+        right = pack_contexts([c.right_ctx for c in candidates], self.width)
+
+        # summed in the same order as Pattern.match
+        sims = (left * self.left).toarray()
+        sims += (middle * self.middle).toarray()
+        sims += (right * self.right).toarray()
+
+        for k in xrange(len(candidates)):
+            sims[k][~self.tag_mask(candidates[k].tag_one, candidates[k].tag_two)] = 0.0
+
+        return sims
+
+
+    def score(self, candidates):
+        """Returns a (best similarity, best pattern,
+        matches) triple for every candidate, where
+        matches lists the (similarity, pattern) pairs
+        at or above the threshold in pattern order.
+        Ties for the best pattern go to the later
+        pattern, as in the original matching loop."""
+
+        if len(candidates) == 0:
+            return []
+
+        if len(self.patterns) == 0:
+            return [(0.0, None, []) for _ in candidates]
+
+        results = []
+        sims = self.similarities(candidates)
+        self.comparisons += len(candidates) * len(self.patterns)
+
+        for k in xrange(len(candidates)):
+            row = sims[k]
+            hits = np.flatnonzero(row >= self.threshold)
+            matches = [(float(row[h]), self.patterns[h]) for h in hits]
+
+            if len(hits) == 0:
+                results.append((0.0, None, matches))
+            else:
+                best = hits[len(hits) - 1 - np.argmax(row[hits][::-1])]
+                results.append((float(row[best]), self.patterns[best], matches))
+
+        return results
+
+
+class LSHPatternScorer:
+    """Approximate PatternScorer. Patterns are
+    bucketed by random-hyperplane signatures of
+    their weighted contexts, split into bands;
+    a candidate is only scored, exactly, against
+    the patterns sharing at least one band with
+    it. More bands raise recall, more rows per
+    band shorten the shortlists."""
+
+    def __init__(self, patterns, threshold=config.SNOWBALL_MIN_PATTERN_SIMILARITY, bands=config.SNOWBALL_LSH_BANDS, rows=config.SNOWBALL_LSH_ROWS, seed=config.SNOWBALL_LSH_SEED):
+        self.patterns = patterns
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.seed = seed
+        self.comparisons = 0 # (candidate, pattern) similarities computed
+        self.planes = {} # (side, feature) -> hyperplane components
+        self.buckets = {} # (band, bits) -> pattern positions
+
+        for position in xrange(len(patterns)):
+            for key in self.band_keys(patterns[position]):
+                self.buckets.setdefault(key, []).append(position)
+
+
+    def components(self, side, feature):
+        key = (side, feature)
+
+        if key not in self.planes:
+            rng = random.Random(hash((self.seed,) + key))
+            self.planes[key] = np.array([rng.gauss(0.0, 1.0) for _ in xrange(self.bands * self.rows)])
+
+        return self.planes[key]
+
+
+    def band_keys(self, pattern):
+        projection = np.zeros(self.bands * self.rows)
+
+        for (side, ctx) in enumerate((pattern.left_ctx, pattern.middle_ctx, pattern.right_ctx)):
+            for (feature, val) in ctx.items():
+                projection += val * self.components(side, feature)
+
+        bits = projection > 0
+
+        return [(band, tuple(bits[band*self.rows:(band+1)*self.rows]))
+                for band in xrange(self.bands)]
+
+
+    def shortlist(self, candidate):
+        positions = set()
+
+        for key in self.band_keys(candidate):
+            positions.update(self.buckets.get(key, []))
+
+        return sorted(positions)
+
+
+    def score(self, candidates):
+        """Same contract as PatternScorer.score;
+        similarities of shortlisted patterns are
+        exact, so only recall is approximate."""
+
+        results = []
+
+        for candidate in candidates:
+            best_similarity = 0.0
+            best_pattern = None
+            matches = []
+
+            shortlist = self.shortlist(candidate)
+            self.comparisons += len(shortlist)
+
+            for position in shortlist:
+                pattern = self.patterns[position]
+                similarity = pattern.match(candidate)
+
+                if similarity >= self.threshold:
+                    matches.append((similarity, pattern))
+
+                    if similarity >= best_similarity:
+                        best_similarity = similarity
+                        best_pattern = pattern
+
+            results.append((best_similarity, best_pattern, matches))
+
+        return results
+
+
+class PartitionedScorer:
+    """Scores candidates against the partition
+    of a PatternStore for their tag pair only.
+    With approximate set, partitions are
+    searched with LSHPatternScorer instead."""
+
+    def __init__(self, store, threshold=config.SNOWBALL_MIN_PATTERN_SIMILARITY, approximate=config.SNOWBALL_LSH_MATCHING):
+        self.store = store
+        self.threshold = threshold
+        self.scorers = {}
+
+        for tags in store.tag_pairs():
+            if approximate:
+                self.scorers[tags] = LSHPatternScorer(store.partition(*tags), threshold)
+            else:
+                self.scorers[tags] = PatternScorer(store.partition(*tags), threshold)
+
+
+    @property
+    def comparisons(self):
+        return sum(scorer.comparisons for scorer in self.scorers.values())
+
+
+    def score(self, candidates):
+        """Same results as scoring every pattern of
+        the store at once."""
+
+        results = [(0.0, None, [])] * len(candidates)
+        groups = {}
+
+        for k in xrange(len(candidates)):
+            tags = (candidates[k].tag_one, candidates[k].tag_two)
+            groups.setdefault(tags, []).append(k)
+
+        for (tags, positions) in groups.items():
+            if tags not in self.scorers:
+                continue
+
+            scores = self.scorers[tags].score([candidates[k] for k in positions])
+
+            for (k, result) in zip(positions, scores):
+                results[k] = result
+
+        return results
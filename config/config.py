@@ -9,6 +9,8 @@ RESOURCES_DIR = "%s/resources" % HOME_DIR
 
 # Stanford CoreNLP settings
 STANFORD_CORENLP_DIR = "%s/stanford-corenlp-full-2015-04-20/*" % RESOURCES_DIR
+CORENLP_BATCH_PAGES = 20 # most pages packed into one CoreNLP call
+CORENLP_BATCH_CHARS = 20000 # pages are packed until their text reaches this length
 
 # Stanford parser settings
 STANFORD_PARSER_DIR = "%s/stanford-parser-full-2015-04-20" % RESOURCES_DIR
@@ -19,6 +21,17 @@ STARFORD_PARSER_MODELS_JAR_FILE = "%s/stanford-parser-3.5.2-models.jar" % STANFO
 ELASTICSEARCH_HOST = 'localhost'
 ELASTICSEARCH_PORT = 9200
 ELASTICSEARCH_RESULTS_SIZE = 100
+ELASTICSEARCH_PAGE_SIZE = 500 # hits per request of paged searches
+ELASTICSEARCH_SCROLL_SIZE = 500 # hits per page of es.scroll_sentences, which builds local corpora
+ELASTICSEARCH_SCROLL_TIMEOUT = '5m' # must outlast the processing of one scroll page
+ELASTICSEARCH_MSEARCH_SIZE = 50 # queries per _msearch request
+ELASTICSEARCH_BULK_DOCS = 1000 # documents per _bulk request
+ELASTICSEARCH_BULK_BYTES = 5 * 1024**2 # bytes per _bulk request
+ELASTICSEARCH_BULK_MAX_AGE = 5.0 # seconds after which the next add sends the _bulk buffer
+ELASTICSEARCH_CACHE_FILE = "%s/sentence_cache.db" % RESOURCES_DIR # None to always go to Elasticsearch
+ELASTICSEARCH_CACHE_SIZE = 2 * 1024**3 # bytes of pickled results kept before evicting the least recently used
+ELASTICSEARCH_CACHE_MAX_HITS = 10000 # larger seed tuple results are streamed but not cached
+ELASTICSEARCH_SENTENCE_SOURCE = ['id', 'index', 'tokens', 'tagged_tokens', 'entity_tags'] # fields sent back for sentence hits
 ELASTICSEARCH_INDEX = 'wikipedia_test'
 ELASTICSEARCH_PAGE_TYPE = 'page'
 ELASTICSEARCH_SENTENCE_TYPE = 'sentence'
@@ -35,6 +48,8 @@ WIKIPEDIA_EXTRACTED_DIR = "%s/extracted2" % WIKIPEDIA_DIR
 WIKIPEDIA_SUB_DIR_PREFIXES = []
 WIKIPEDIA_START_TAG_RGX = "^<doc id=\".*\" url=\".*\" title=\".*\">\n$"
 WIKIPEDIA_END_TAG_RGX = "^</doc>\n?$"
+WIKIPEDIA_INDEX_QUEUE_SIZE = 8 # page batches buffered between stages of index/index.py
+WIKIPEDIA_INDEX_MANIFEST_FILE = "%s/index_manifest" % WIKIPEDIA_DIR # files and pages indexed so far
 
 # Logging settings
 LOGS_DIR = "%s/logs" % RESOURCES_DIR
@@ -47,14 +62,27 @@ SNOWBALL_CURRENT_RUN_DIR = "%s/<some_name>" % SNOWBALL_RESOURCE_DIR
 SNOWBALL_SEEDS_FILE = "%s/seeds" % SNOWBALL_CURRENT_RUN_DIR
 SNOWBALL_TUPLES_FILE = "%s/tuples" % SNOWBALL_CURRENT_RUN_DIR
 SNOWBALL_PATTERNS_FILE = "%s/patterns" % SNOWBALL_CURRENT_RUN_DIR
+SNOWBALL_STATS_FILE = "%s/stats" % SNOWBALL_CURRENT_RUN_DIR # per-iteration timings and counters
+SNOWBALL_CHECKPOINT_FILE = "%s/checkpoint" % SNOWBALL_CURRENT_RUN_DIR
+SNOWBALL_CORPUS_BACKEND = 'elasticsearch' # or 'local' to read sentences from SNOWBALL_CORPUS_DIR
+SNOWBALL_CORPUS_DIR = "%s/corpus" % SNOWBALL_RESOURCE_DIR # built with corpus/build.py
 SNOWBALL_SENTENCE_CAP = 10000 # how many text segments to consider
 SNOWBALL_LR_MAX_WINDOW = 2 # maximum number of tokens in left/right contexts
 SNOWBALL_LEFT_CTX_WEIGHT = 0.1#0.2 # weight for left context
 SNOWBALL_MIDDLE_CTX_WEIGHT = 0.8#0.6 # weight for middle context
 SNOWBALL_RIGHT_CTX_WEIGHT = 0.1#0.2 # weight for right context
+SNOWBALL_SPARSE_CONTEXTS = True # store contexts as sorted token id/weight arrays
 SNOWBALL_NUM_ITERATIONS = 10 # number of iterations to perform
 SNOWBALL_MIN_PATTERN_SUPPORT = 2 # minimum number of patterns per cluster
 SNOWBALL_MIN_TUPLE_CONFIDENCE = 0.8#0.8 # minimum acceptable tuple confidence
 SNOWBALL_MIN_PATTERN_SIMILARITY = 0.6#0.6 # minimum degree of match for patterns
+SNOWBALL_REFRESH_CLUSTER_REP = False # move cluster reps to the centroid after each insertion
+SNOWBALL_LSH_MATCHING = False # shortlist snowball patterns with LSH before exact matching
+SNOWBALL_LSH_BANDS = 20 # more bands: higher recall, longer shortlists
+SNOWBALL_LSH_ROWS = 10 # more hyperplanes per band: shorter shortlists, lower recall
+SNOWBALL_LSH_SEED = 0 # seed for the random hyperplanes
 SNOWBALL_PATTERN_CONFIDENCE_UPDATE_FACTOR = 0.5 # factor to use in EWMA
 SNOWBALL_TUPLE_CONFIDENCE_UPDATE_FACTOR = 0.5 # factor to use in EWMA
+SNOWBALL_NUM_PROCESSES = 1 # worker processes for tuple extraction (1 = serial)
+SNOWBALL_SHARD_SIZE = 100 # sentences matched per extraction task
+SNOWBALL_PREFETCH_SIZE = 1000 # seed sentence hits fetched ahead of pattern extraction (0 to fetch inline)
@@ -0,0 +1,84 @@
+import os
+import re
+import mmap
+from HTMLParser import HTMLParser
+
+from utils import io
+
+
+DOC_START = '<doc '
+DOC_END = '\n</doc>'
+ATTRIBUTE_RGX = re.compile(r'(\w+)="([^"]*)"')
+UNESCAPER = HTMLParser() # named and numeric references, as xmltodict decodes them
+
+
+def parse_header(header):
+    """Given the <doc ...> line of a page, returns
+    the page dictionary of parser.get_page."""
+
+    attributes = dict((name, UNESCAPER.unescape(io.to_unicode(value)))
+                      for (name, value) in ATTRIBUTE_RGX.findall(header))
+
+    page = {}
+
+    page[u'id'] = int(attributes['id'])
+    page[u'url'] = attributes['url']
+    page[u'title'] = attributes['title']
+    page[u'title_not_analyzed'] = page['title']
+
+    return page
+
+
+def find_end(m, pos):
+    """Start of the first </doc> line at or after
+    pos, or -1."""
+
+    end = m.find(DOC_END, pos)
+
+    # </doc> must make up the whole line
+    while end >= 0 and end + len(DOC_END) < len(m) and m[end + len(DOC_END)] != '\n':
+        end = m.find(DOC_END, end + 1)
+
+    return end
+
+
+def iter_documents(path):
+    """Lazily yields the (page, text) pairs of a
+    plain text wikipedia file, in file order. The
+    file is memory-mapped and split on its <doc>
+    and </doc> lines, giving the same pages and
+    texts as repeated parser.scan_next calls."""
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            pos = 0
+
+            while True:
+                start = m.find(DOC_START, pos)
+
+                # a page starts at the beginning of a line
+                while start > 0 and m[start - 1] != '\n':
+                    start = m.find(DOC_START, start + 1)
+                if start < 0:
+                    return
+
+                header_end = m.find('\n', start)
+                if header_end < 0:
+                    return
+
+                # the newline ending the last line of text is the one before </doc>
+                end = find_end(m, header_end)
+                if end < 0:
+                    return
+
+                yield (parse_header(m[start:header_end]),
+                       io.to_unicode(m[header_end + 1:end + 1]))
+
+                pos = end + len(DOC_END)
+        finally:
+            m.close()
@@ -1,3 +1,5 @@
+import os
+import bisect
 import xmltodict
 import collections
 import nltk
@@ -71,10 +73,14 @@ def text_to_sentences(text, sent_tokenizer):
     return sent_tokenizer.tokenize(text)
 
 
+PAGE_SEPARATOR = u'\n\n' # a sentence break for CoreNLP, see get_parser
+
+
 def get_parser():
     corenlp = CoreNLP(
         configdict={
-            'annotators': 'tokenize,ssplit,pos,lemma,ner'
+            'annotators': 'tokenize,ssplit,pos,lemma,ner',
+            'ssplit.newlineIsSentenceBreak': 'two'
         },
         output_types=['ssplit','ner'],
         corenlp_jars=[config.STANFORD_CORENLP_DIR])
@@ -82,12 +88,67 @@ def get_parser():
     return corenlp
 
 
+class WorkerParser:
+    """Stands in for the CoreNLP wrapper, starting
+    its process on first use. A WorkerParser made
+    before workers fork gives each of them a
+    CoreNLP process of its own."""
+
+    def __init__(self):
+        self.corenlp = None
+        self.pid = None
+
+
+    def parse_doc(self, text):
+        if self.pid != os.getpid():
+            self.corenlp = get_parser()
+            self.pid = os.getpid()
+
+        return self.corenlp.parse_doc(text)
+
+
 def parse(text, corenlp):
     """Main function for CoreNLP parser."""
 
     return corenlp.parse_doc(text)
 
 
+def java_length(text):
+    # CoreNLP offsets count UTF-16 code units
+    return len(text.encode('utf-16-le')) / 2
+
+
+def pack_texts(texts):
+    """Joins texts into one document for a single
+    CoreNLP call. Returns the document and the
+    (start, end) offsets of every text in it."""
+
+    ranges = []
+    offset = 0
+
+    for text in texts:
+        end = offset + java_length(text)
+        ranges.append((offset, end))
+        offset = end + java_length(PAGE_SEPARATOR)
+
+    return (PAGE_SEPARATOR.join(texts), ranges)
+
+
+def split_sentences(sents, ranges):
+    """Groups the sentences of the CoreNLP parse of
+    a packed document by text, going by the offset
+    of their first token."""
+
+    starts = [start for (start, _) in ranges]
+    groups = [[] for _ in ranges]
+
+    for sent in sents:
+        k = bisect.bisect_right(starts, sent['char_offsets'][0][0]) - 1
+        groups[k].append(sent)
+
+    return groups
+
+
 def scan_next(f):
     """Given the handler of the
     plain text wikipedia file,
@@ -136,10 +197,14 @@ def get_page(xml):
 def collapse(sent):
     """Given a sentence dictionary,
     returns a list of tokens grouped
-    by their named entity tagging."""
+    by their named entity tagging,
+    the tagged version of that list
+    and the entity tag of each token
+    (u'O' for untagged tokens)."""
 
     new_tokens = []
     tagged_tokens = []
+    entity_tags = []
     cur_token = None
     cur_entity = u'O'
     tagging_pattern = "<%s>%s</%s>"
@@ -152,6 +217,7 @@ def collapse(sent):
             if e == u'O':
                 new_tokens.append(t)
                 tagged_tokens.append(t)
+                entity_tags.append(e)
             else:
                 cur_token = t
                 cur_entity = e
@@ -163,6 +229,8 @@ def collapse(sent):
                                                         cur_token,
                                                         cur_entity))
                 tagged_tokens.append(t)
+                entity_tags.append(cur_entity)
+                entity_tags.append(e)
                 cur_token = None
                 cur_entity = u'O'
             elif e == cur_entity:
@@ -172,10 +240,11 @@ def collapse(sent):
                 tagged_tokens.append(tagging_pattern % (cur_entity,
                                                         cur_token,
                                                         cur_entity))
+                entity_tags.append(cur_entity)
                 cur_token = t
                 cur_entity = e
                 
-    return (new_tokens, tagged_tokens)
+    return (new_tokens, tagged_tokens, entity_tags)
 
 
 def simplify_sentence(sent):
@@ -184,10 +253,11 @@ def simplify_sentence(sent):
     concise version."""
 
     new_sent = {}
-    (tokens, tagged_tokens) = collapse(sent)
+    (tokens, tagged_tokens, entity_tags) = collapse(sent)
 
     new_sent[u'tokens'] = tokens
     new_sent[u'tagged_tokens'] = tagged_tokens
+    new_sent[u'entity_tags'] = entity_tags
     new_sent[u'entities'] = list(set(sent['ner']))
     
     return new_sent
@@ -199,9 +269,12 @@ def get_sentences(text, corenlp):
     each of which are represententions
     of the sentences from the xml text."""
 
+    return simplify_sentences(parse(text, corenlp)['sentences'])
+
+
+def simplify_sentences(sents):
     new_sents = []
-    sents = parse(text, corenlp)['sentences']
-    
+
     for i in xrange(len(sents)):
         new_sent = simplify_sentence(sents[i])
         new_sent[u'index'] = i
@@ -227,3 +300,25 @@ def combined_parse(xml, text, corenlp):
     combined_parse[u'sentences'] = sentences
 
     return combined_parse
+
+
+def combined_parse_batch(docs, corenlp):
+    """Same as combined_parse for a list of (page,
+    text) pairs from documents.iter_documents,
+    with all texts parsed in a single CoreNLP
+    call."""
+
+    (text, ranges) = pack_texts([t for (_, t) in docs])
+    groups = split_sentences(parse(text, corenlp)['sentences'], ranges)
+    combined_parses = []
+
+    for ((page, _), sents) in zip(docs, groups):
+        sentences = simplify_sentences(sents)
+
+        for sent in sentences:
+            sent[u'id'] = page['id']
+
+        combined_parses.append({u'page': page,
+                                u'sentences': sentences})
+
+    return combined_parses
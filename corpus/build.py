@@ -0,0 +1,37 @@
+import argparse
+
+from utils import log
+from corpus import store
+from elastic import es
+from config import config
+
+
+def main(args):
+    print "Running..."
+
+    logger = log.create_logger("corpus", "corpus.log")
+    writer = store.CorpusWriter(args.output)
+
+    # one pass over the indexed sentences, already in (id, index) order
+    for hit in es.scroll_sentences():
+        writer.add(hit['_source'])
+
+        if writer.count % 100000 == 0:
+            logger.info("Copied %d sentences", writer.count)
+
+    writer.close()
+    logger.info("Built corpus of %d sentences in %s", writer.count, args.output)
+
+    print "Done!"
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser()
+
+    argparser.add_argument('-o', '--output',
+                           default=config.SNOWBALL_CORPUS_DIR,
+                           help='Directory to build the corpus in')
+
+    args = argparser.parse_args()
+
+    main(args)
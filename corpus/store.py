@@ -0,0 +1,243 @@
+import os
+import json
+import array
+
+import numpy as np
+
+from classes import classes
+from config import config
+
+
+FORMAT_VERSION = 1
+SEQUENCE_FIELDS = ['tokens', 'tagged_tokens', 'entity_tags'] # stored per sentence
+POSTING_FIELDS = ['tagged_tokens', 'entities'] # searchable
+
+
+def open_array(path, dtype):
+    # numpy refuses to map empty files
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+class CorpusWriter:
+    """Builds a corpus directory out of sentence
+    documents, as given to es.index_sentence, in
+    increasing (id, index) order. Sentences go
+    straight to disk; posting lists are kept in
+    memory until close."""
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        self.path = path
+        self.string_ids = {}
+        self.strings = []
+        self.count = 0
+        self.last = None
+        self.pages = array.array('l')
+        self.indexes = array.array('l')
+        self.files = dict((field, open(os.path.join(path, "%s.dat" % field), 'wb')) for field in SEQUENCE_FIELDS)
+        self.pointers = dict((field, array.array('l', [0])) for field in SEQUENCE_FIELDS)
+        self.postings = dict((field, {}) for field in POSTING_FIELDS) # field -> string id -> sentence numbers
+
+
+    def string_id(self, string):
+        if string not in self.string_ids:
+            self.string_ids[string] = len(self.strings)
+            self.strings.append(string)
+
+        return self.string_ids[string]
+
+
+    def add(self, sentence):
+        key = (sentence['id'], sentence['index'])
+
+        if self.last is not None and key <= self.last:
+            raise ValueError("Sentence %r added after %r" % (key, self.last))
+
+        self.last = key
+        self.pages.append(sentence['id'])
+        self.indexes.append(sentence['index'])
+
+        values = dict(sentence)
+
+        if values.get('entity_tags') is None:
+            values['entity_tags'] = [classes.entity_tag(tagged_token) for tagged_token in sentence['tagged_tokens']]
+
+        for field in SEQUENCE_FIELDS:
+            ids = array.array('i', [self.string_id(string) for string in values[field]])
+            ids.tofile(self.files[field])
+            self.pointers[field].append(self.pointers[field][-1] + len(ids))
+
+        for field in POSTING_FIELDS:
+            for string_id in set(self.string_id(string) for string in values.get(field, [])):
+                self.postings[field].setdefault(string_id, array.array('i')).append(self.count)
+
+        self.count += 1
+
+
+    def write_array(self, name, values, typecode):
+        with open(os.path.join(self.path, "%s.dat" % name), 'wb') as f:
+            array.array(typecode, values).tofile(f)
+
+
+    def close(self):
+        for field in SEQUENCE_FIELDS:
+            self.files[field].close()
+            self.write_array("%s_ptr" % field, self.pointers[field], 'l')
+
+        self.write_array('pages', self.pages, 'l')
+        self.write_array('indexes', self.indexes, 'l')
+
+        # posting lists are laid out by string id
+        for field in POSTING_FIELDS:
+            pointers = array.array('l', [0])
+
+            with open(os.path.join(self.path, "%s_postings.dat" % field), 'wb') as f:
+                for string_id in xrange(len(self.strings)):
+                    postings = self.postings[field].get(string_id, array.array('i'))
+                    postings.tofile(f)
+                    pointers.append(pointers[-1] + len(postings))
+
+            self.write_array("%s_postings_ptr" % field, pointers, 'l')
+
+        with open(os.path.join(self.path, 'strings.json'), 'w') as f:
+            json.dump(self.strings, f)
+
+        # written last, so a partial build does not load
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump({'version': FORMAT_VERSION,
+                       'sentences': self.count,
+                       'strings': len(self.strings)}, f)
+
+
+class CorpusStore:
+    """Read-only, memory-mapped corpus built by
+    CorpusWriter. Answers the sentence queries
+    of the elastic.es module, with hits in the
+    same (id, index) order, without a running
+    Elasticsearch node."""
+
+    def __init__(self, path=config.SNOWBALL_CORPUS_DIR):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        if meta['version'] > FORMAT_VERSION:
+            raise ValueError("Unsupported corpus version %r in %s" % (meta['version'], path))
+
+        with open(os.path.join(path, 'strings.json')) as f:
+            self.strings = json.load(f)
+
+        self.string_ids = dict((string, k) for (k, string) in enumerate(self.strings))
+        self.count = meta['sentences']
+        self.pages = open_array(os.path.join(path, 'pages.dat'), np.int64)
+        self.indexes = open_array(os.path.join(path, 'indexes.dat'), np.int64)
+        self.sequences = {}
+        self.postings = {}
+
+        for field in SEQUENCE_FIELDS:
+            self.sequences[field] = (open_array(os.path.join(path, "%s.dat" % field), np.int32),
+                                     open_array(os.path.join(path, "%s_ptr.dat" % field), np.int64))
+
+        for field in POSTING_FIELDS:
+            self.postings[field] = (open_array(os.path.join(path, "%s_postings.dat" % field), np.int32),
+                                    open_array(os.path.join(path, "%s_postings_ptr.dat" % field), np.int64))
+
+
+    def posting_list(self, field, string):
+        string_id = self.string_ids.get(string)
+
+        if string_id is None:
+            return np.zeros(0, dtype=np.int32)
+
+        (postings, pointers) = self.postings[field]
+
+        return postings[pointers[string_id]:pointers[string_id+1]]
+
+
+    def matching(self, field, strings):
+        """Returns the sorted numbers of the sentences
+        whose field holds every one of strings."""
+
+        matches = self.posting_list(field, strings[0])
+
+        for string in strings[1:]:
+            matches = np.intersect1d(matches, self.posting_list(field, string), assume_unique=True)
+
+        return matches
+
+
+    def hit(self, k, source=config.ELASTICSEARCH_SENTENCE_SOURCE):
+        values = {'id': int(self.pages[k]),
+                  'index': int(self.indexes[k])}
+
+        for field in SEQUENCE_FIELDS:
+            if field in source:
+                (ids, pointers) = self.sequences[field]
+                values[field] = [self.strings[string_id] for string_id in ids[pointers[k]:pointers[k+1]]]
+
+        return {'_id': "%d_%d" % (values['id'], values['index']),
+                '_source': dict((field, values[field]) for field in source if field in values)}
+
+
+    def hits(self, matches, from_offset, size, source=config.ELASTICSEARCH_SENTENCE_SOURCE):
+        return [self.hit(k, source) for k in matches[from_offset:from_offset+size]]
+
+
+    def count_sentences(self):
+        return self.count
+
+
+    def count_sentences_containing(self, tup):
+        return len(self.matching('tagged_tokens', [tup.subj_string(), tup.obj_string()]))
+
+
+    def count_sentences_with_tags(self, tag_one, tag_two):
+        return len(self.matching('entities', [tag_one, tag_two]))
+
+
+    def get_sentences_containing(self, tup, from_offset=0, size=config.ELASTICSEARCH_RESULTS_SIZE, source=config.ELASTICSEARCH_SENTENCE_SOURCE):
+        return self.hits(self.matching('tagged_tokens', [tup.subj_string(), tup.obj_string()]),
+                         from_offset,
+                         size,
+                         source)
+
+
+    def get_sentences_containing_batch(self, tuples, batch_size=config.ELASTICSEARCH_MSEARCH_SIZE, page_size=config.ELASTICSEARCH_PAGE_SIZE, source=config.ELASTICSEARCH_SENTENCE_SOURCE):
+        for tup in tuples:
+            for k in self.matching('tagged_tokens', [tup.subj_string(), tup.obj_string()]):
+                yield (tup, self.hit(k, source))
+
+
+    def get_sentences_with_tags(self, tag_one, tag_two, from_offset=0, size=config.ELASTICSEARCH_RESULTS_SIZE, source=config.ELASTICSEARCH_SENTENCE_SOURCE):
+        return self.hits(self.matching('entities', [tag_one, tag_two]),
+                         from_offset,
+                         size,
+                         source)
+
+
+    def page_sentences_with_tags(self, tag_one, tag_two, from_offset=0, page_size=config.ELASTICSEARCH_PAGE_SIZE, source=config.ELASTICSEARCH_SENTENCE_SOURCE):
+        for k in self.matching('entities', [tag_one, tag_two])[from_offset:]:
+            yield self.hit(k, source)
+
+
+    def get_sentence_by_ids(self, page_id, sentence_index):
+        start = np.searchsorted(self.pages, page_id, side='left')
+        end = np.searchsorted(self.pages, page_id, side='right')
+        k = start + np.searchsorted(self.indexes[start:end], sentence_index)
+
+        if k == end or self.indexes[k] != sentence_index:
+            raise KeyError("%s_%s" % (page_id, sentence_index))
+
+        return self.hit(k, ['id', 'index'] + SEQUENCE_FIELDS)['_source']
+
+
+    def cache_stats(self):
+        return (0, 0) # the store is local, nothing to cache
+
+
+    def request_count(self):
+        return 0
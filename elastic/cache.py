@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import threading
+import cPickle as pickle
+
+
+class SentenceCache:
+    """Size-bounded, least recently used store of
+    Elasticsearch results in a sqlite file. Entries
+    are tagged with the index they came from so
+    they can be purged when it is rebuilt."""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock() # the connection is shared with prefetch threads
+        self.pid = None
+        self.conn = None
+        self.clock = 0
+        self.total_bytes = 0
+
+
+    def connect(self):
+        # sqlite connections must not cross a fork
+        if self.pid == os.getpid():
+            return
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA synchronous = OFF") # a lost write only costs a refetch
+        self.conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                          "key TEXT PRIMARY KEY, "
+                          "idx TEXT, "
+                          "value BLOB, "
+                          "size INTEGER, "
+                          "used INTEGER)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_idx ON entries (idx)")
+        self.conn.commit()
+
+        (clock, total_bytes) = self.conn.execute("SELECT MAX(used), SUM(size) FROM entries").fetchone()
+        self.clock = clock or 0
+        self.total_bytes = total_bytes or 0
+        self.pid = os.getpid()
+
+
+    def get(self, key):
+        """Returns the value stored under key, or
+        None if there is none."""
+
+        with self.lock:
+            self.connect()
+            row = self.conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.clock += 1
+            self.conn.execute("UPDATE entries SET used = ? WHERE key = ?", (self.clock, key))
+            self.conn.commit()
+
+        return pickle.loads(str(row[0]))
+
+
+    def put(self, key, idx, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+        if len(data) > self.max_bytes:
+            return
+
+        with self.lock:
+            self.connect()
+            row = self.conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+
+            if row is not None:
+                self.total_bytes -= row[0]
+
+            self.clock += 1
+            self.conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                              (key, idx, sqlite3.Binary(data), len(data), self.clock))
+            self.total_bytes += len(data)
+            self.evict()
+            self.conn.commit()
+
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute("SELECT key, size FROM entries ORDER BY used LIMIT 100").fetchall()
+
+            for (key, size) in rows:
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.total_bytes -= size
+
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+
+    def purge(self, idx):
+        """Drops every entry of index idx."""
+
+        with self.lock:
+            self.connect()
+            self.conn.execute("DELETE FROM entries WHERE idx = ?", (idx,))
+            self.conn.commit()
+            self.total_bytes = self.conn.execute("SELECT SUM(size) FROM entries").fetchone()[0] or 0
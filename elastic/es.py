@@ -1,22 +1,120 @@
 import math
-from elasticsearch import Elasticsearch
+import json
+import time
+import itertools
+from elasticsearch import Elasticsearch, ElasticsearchException, Transport
 
 from config import config
+from elastic.cache import SentenceCache
 
 
-client = Elasticsearch([{'host': config.ELASTICSEARCH_HOST,
-                         'port': config.ELASTICSEARCH_PORT}])
+client = None
+cache = None # read-through sentence cache, opened on first use
+index_generations = {} # index -> (creation date, documents), so a rebuilt or grown index misses the cache
+
+
+class CountingTransport(Transport):
+    requests = 0 # HTTP requests sent by this process
+
+
+    def perform_request(self, *args, **kwargs):
+        CountingTransport.requests += 1
+        return Transport.perform_request(self, *args, **kwargs)
+
+
+def connect(): # (re)create the client, e.g. in a forked worker process
+    global client
+    client = Elasticsearch([{'host': config.ELASTICSEARCH_HOST,
+                             'port': config.ELASTICSEARCH_PORT}],
+                           transport_class=CountingTransport)
+
+
+connect()
 
 
 def create_index(index):
+    index_generations.pop(index, None)
     return client.indices.create(index=index, ignore=400)
 
 
 def delete_index(index):
+    if get_cache() is not None:
+        cache.purge(index)
+
+    index_generations.pop(index, None)
     return client.indices.delete(index=index, ignore=[400, 404])
 
 ####################################################################################
 
+def get_cache():
+    global cache
+
+    if cache is None and config.ELASTICSEARCH_CACHE_FILE is not None:
+        cache = SentenceCache(config.ELASTICSEARCH_CACHE_FILE,
+                              config.ELASTICSEARCH_CACHE_SIZE)
+
+    return cache
+
+
+def cache_stats():
+    """Returns the (hits, misses) of the sentence
+    cache so far."""
+
+    if cache is None:
+        return (0, 0)
+
+    return (cache.hits, cache.misses)
+
+
+def request_count():
+    return CountingTransport.requests
+
+
+def index_generation(index):
+    """The creation date and document count of
+    index, read once per process: results cached
+    before documents were added to it, e.g. by a
+    resumed indexer, are not served."""
+
+    if index not in index_generations:
+        settings = client.indices.get_settings(index=index).values()[0]
+        index_generations[index] = [settings['settings']['index'].get('creation_date', ''),
+                                    client.count(index=index)['count']]
+
+    return index_generations[index]
+
+
+def cache_key(name, args, index, doc_type):
+    return json.dumps([name, index, index_generation(index), doc_type, args])
+
+
+def cache_get(name, args, index, doc_type):
+    """Returns the cached result of accessor name
+    called with args, or None on a miss or when
+    caching is off."""
+
+    if get_cache() is None:
+        return None
+
+    return cache.get(cache_key(name, args, index, doc_type))
+
+
+def cache_put(name, args, index, doc_type, value):
+    if get_cache() is not None:
+        cache.put(cache_key(name, args, index, doc_type), index, value)
+
+
+def cached(name, args, index, doc_type, fetch):
+    value = cache_get(name, args, index, doc_type)
+
+    if value is None:
+        value = fetch()
+        cache_put(name, args, index, doc_type, value)
+
+    return value
+
+####################################################################################
+
 def put_page_mapping(mapping, index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTICSEARCH_PAGE_TYPE):
     return client.indices.put_mapping(
         doc_type=doc_type,
@@ -50,6 +148,21 @@ def page_exists(pageId, index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTI
                          doc_type=doc_type,
                          id=pageId)
 
+
+def pages_exist(page_ids, index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTICSEARCH_PAGE_TYPE):
+    """The subset of page_ids already indexed, in
+    one _mget request."""
+
+    if not page_ids:
+        return set()
+
+    response = client.mget(body={'ids': [str(page_id) for page_id in page_ids]},
+                           index=index,
+                           doc_type=doc_type,
+                           _source=False)
+
+    return set(int(doc['_id']) for doc in response['docs'] if doc.get('found'))
+
 ####################################################################################
 
 def index_page(page, index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTICSEARCH_PAGE_TYPE):
@@ -75,6 +188,92 @@ def index_raw_sentence(sentence, index=config.ELASTICSEARCH_INDEX, doc_type=conf
         body=sentence,
         id="%d_%d" % (sentence['id'], sentence['index']))
 
+
+class BulkIndexer:
+    """Buffers documents and indexes them with _bulk
+    requests of at most max_docs documents or
+    max_bytes bytes. The buffer is also sent when
+    a document is added to it more than max_age
+    seconds after its first one; there is no
+    timer, so an idle buffer waits for the next
+    add or an explicit flush(). Failed items are
+    counted and passed to on_error(doc_type, id,
+    error) rather than raised."""
+
+    def __init__(self, max_docs=config.ELASTICSEARCH_BULK_DOCS, max_bytes=config.ELASTICSEARCH_BULK_BYTES, max_age=config.ELASTICSEARCH_BULK_MAX_AGE, on_error=None, index=config.ELASTICSEARCH_INDEX):
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.on_error = on_error
+        self.index = index
+        self.lines = []
+        self.docs = 0
+        self.bytes = 0
+        self.started = None
+        self.indexed = 0
+        self.failed = 0
+
+
+    def add(self, body, doc_type, doc_id):
+        action = json.dumps({"index": {"_index": self.index,
+                                       "_type": doc_type,
+                                       "_id": doc_id}})
+        source = json.dumps(body)
+        size = len(action) + len(source) + 2
+
+        if self.docs > 0 and self.bytes + size > self.max_bytes:
+            self.flush()
+
+        if self.started is None:
+            self.started = time.time()
+
+        self.lines.append(action)
+        self.lines.append(source)
+        self.docs += 1
+        self.bytes += size
+
+        if self.docs >= self.max_docs or time.time() - self.started >= self.max_age: # checked on add only
+            self.flush()
+
+
+    def index_page(self, page, doc_type=config.ELASTICSEARCH_PAGE_TYPE):
+        self.add(page, doc_type, str(page['id']))
+
+
+    def index_sentence(self, sentence, doc_type=config.ELASTICSEARCH_SENTENCE_TYPE):
+        self.add(sentence, doc_type, "%d_%d" % (sentence['id'], sentence['index']))
+
+
+    def index_raw_sentence(self, sentence, doc_type=config.ELASTICSEARCH_RAW_SENTENCE_TYPE):
+        self.add(sentence, doc_type, "%d_%d" % (sentence['id'], sentence['index']))
+
+
+    def flush(self):
+        """Sends the buffered documents, if any."""
+
+        if self.docs == 0:
+            return
+
+        response = client.bulk(body="\n".join(self.lines) + "\n")
+        failed = 0
+
+        if response.get('errors'):
+            for item in response['items']:
+                result = item.values()[0]
+
+                if 'error' in result:
+                    failed += 1
+
+                    if self.on_error is not None:
+                        self.on_error(result['_type'], result['_id'], result['error'])
+
+        self.indexed += self.docs - failed
+        self.failed += failed
+        self.lines = []
+        self.docs = 0
+        self.bytes = 0
+        self.started = None
+
 ####################################################################################
 
 def count_pages(index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTICSEARCH_PAGE_TYPE):
@@ -94,16 +293,7 @@ def count_raw_sentences(index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTI
 
 def count_sentences_containing(tup, index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTICSEARCH_SENTENCE_TYPE):
     body = {
-        "query": {
-            "filtered": {
-                "filter": {
-                    "and": [
-                        {"term": {"tagged_tokens": tup.subj_string()}},
-                        {"term": {"tagged_tokens": tup.obj_string()}}
-                    ]
-                }
-            }
-        }
+        "query": sentences_containing_query(tup)
     }
 
     return client.count(index=index,
@@ -147,25 +337,127 @@ def count_sentences_with_token(token, index=config.ELASTICSEARCH_INDEX, doc_type
 
 ####################################################################################
 
+def sentences_containing_query(tup):
+    return {
+        "filtered": {
+            "filter": {
+                "and": [
+                    {"term": {"tagged_tokens": tup.subj_string()}},
+                    {"term": {"tagged_tokens": tup.obj_string()}}
+                ]
+            }
+        }
+    }
+
+
 def get_sentences_containing(tup, from_offset=0, size=config.ELASTICSEARCH_RESULTS_SIZE, index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTICSEARCH_SENTENCE_TYPE):
     body = {
         "from": from_offset,
-        "query": {
-            "filtered": {
-                "filter": {
-                    "and": [
-                        {"term": {"tagged_tokens": tup.subj_string()}},
-                        {"term": {"tagged_tokens": tup.obj_string()}}
-                    ]
-                }
-            }
-        }
+        "query": sentences_containing_query(tup)
     }
 
-    return client.search(index=index,
-                         doc_type=doc_type,
-                         body=body,
-                         size=size)['hits']['hits']
+    return cached('get_sentences_containing',
+                  [tup.subj_string(), tup.obj_string(), from_offset, size],
+                  index,
+                  doc_type,
+                  lambda: client.search(index=index,
+                                        doc_type=doc_type,
+                                        body=body,
+                                        size=size)['hits']['hits'])
+
+
+def msearch_sentences_containing(tuples, page_size=config.ELASTICSEARCH_PAGE_SIZE, source=config.ELASTICSEARCH_SENTENCE_SOURCE, index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTICSEARCH_SENTENCE_TYPE):
+    """Returns the first page of search response
+    for every tuple from a single _msearch
+    request."""
+
+    body = []
+
+    for tup in tuples:
+        body.append({"index": index,
+                     "type": doc_type})
+        body.append({"_source": source,
+                     "sort": [{"id": "asc"}, {"index": "asc"}],
+                     "from": 0,
+                     "size": page_size,
+                     "query": sentences_containing_query(tup)})
+
+    responses = client.msearch(body=body)['responses']
+
+    for response in responses:
+        if 'error' in response:
+            raise ElasticsearchException(response['error'])
+
+    return responses
+
+
+def page_sentences_containing(tup, response, page_size=config.ELASTICSEARCH_PAGE_SIZE, source=config.ELASTICSEARCH_SENTENCE_SOURCE, index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTICSEARCH_SENTENCE_TYPE):
+    """Yields the hits of a first page response,
+    then pages in the rest of the result set."""
+
+    hits = response['hits']['hits']
+    total = response['hits']['total']
+    from_offset = len(hits)
+
+    for hit in hits:
+        yield hit
+
+    while hits and from_offset < total:
+        body = {
+            "_source": source,
+            "sort": [{"id": "asc"}, {"index": "asc"}],
+            "from": from_offset,
+            "query": sentences_containing_query(tup)
+        }
+        hits = client.search(index=index,
+                             doc_type=doc_type,
+                             body=body,
+                             size=page_size)['hits']['hits']
+        from_offset += len(hits)
+
+        for hit in hits:
+            yield hit
+
+
+def get_sentences_containing_batch(tuples, batch_size=config.ELASTICSEARCH_MSEARCH_SIZE, page_size=config.ELASTICSEARCH_PAGE_SIZE, source=config.ELASTICSEARCH_SENTENCE_SOURCE, index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTICSEARCH_SENTENCE_TYPE):
+    """Yields a (tuple, hit) pair for every sentence
+    containing one of tuples, in tuple order and
+    then (id, index) order. The first page of each
+    uncached tuple's sentences comes back from one
+    _msearch request per batch_size tuples; the
+    rest of a larger result set is paged in
+    page_size hits at a time. Only results of at
+    most ELASTICSEARCH_CACHE_MAX_HITS hits are
+    cached, so no more than that is buffered."""
+
+    tuples = iter(tuples)
+    batch = list(itertools.islice(tuples, batch_size))
+
+    while batch:
+        args = [[tup.subj_string(), tup.obj_string(), source] for tup in batch]
+        cached_hits = [cache_get('get_sentences_containing_batch', a, index, doc_type) for a in args]
+        missing = [tup for (tup, hits) in zip(batch, cached_hits) if hits is None]
+        responses = iter(msearch_sentences_containing(missing, page_size, source, index, doc_type) if missing else [])
+
+        for (tup, a, hits) in zip(batch, args, cached_hits):
+            if hits is not None:
+                for hit in hits:
+                    yield (tup, hit)
+                continue
+
+            hits = [] if cache is not None else None
+
+            for hit in page_sentences_containing(tup, next(responses), page_size, source, index, doc_type):
+                if hits is not None:
+                    hits.append(hit)
+                    if len(hits) > config.ELASTICSEARCH_CACHE_MAX_HITS:
+                        hits = None
+                yield (tup, hit)
+
+            if hits is not None:
+                cache_put('get_sentences_containing_batch', a, index, doc_type, hits)
+
+        batch = list(itertools.islice(tuples, batch_size))
 
 
 def get_raw_sentences_with_substrings_in_page(page_id, substring1, substring2, from_offset=0, size=config.ELASTICSEARCH_RESULTS_SIZE, index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTICSEARCH_RAW_SENTENCE_TYPE):
@@ -223,11 +515,172 @@ def get_sentences_with_tags(tag_one, tag_two, from_offset=0, size=config.ELASTIC
         }
     }
 
+    return cached('get_sentences_with_tags',
+                  [tag_one, tag_two, from_offset, size],
+                  index,
+                  doc_type,
+                  lambda: client.search(index=index,
+                                        doc_type=doc_type,
+                                        body=body,
+                                        size=size)['hits']['hits'])
+
+
+def scroll_pages(body, page_size=config.ELASTICSEARCH_SCROLL_SIZE, scroll=config.ELASTICSEARCH_SCROLL_TIMEOUT, index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTICSEARCH_SENTENCE_TYPE):
+    """Yields the non-empty pages of hits of a
+    scrolled search. The scroll is cleared once
+    the generator is exhausted or closed."""
+
+    response = client.search(index=index,
+                             doc_type=doc_type,
+                             body=body,
+                             scroll=scroll,
+                             size=page_size)
+    scroll_id = response['_scroll_id']
+
+    try:
+        while response['hits']['hits']:
+            yield response['hits']['hits']
+
+            response = client.scroll(scroll_id=scroll_id,
+                                     scroll=scroll)
+            scroll_id = response['_scroll_id']
+    finally:
+        client.clear_scroll(scroll_id=scroll_id, ignore=404)
+
+
+def scroll_sentences(page_size=config.ELASTICSEARCH_SCROLL_SIZE, scroll=config.ELASTICSEARCH_SCROLL_TIMEOUT, index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTICSEARCH_SENTENCE_TYPE):
+    """Streams every sentence in (id, index)
+    order."""
+
+    body = {
+        "sort": [
+            {"id": "asc"},
+            {"index": "asc"}
+        ],
+        "query": {
+            "match_all": {}
+        }
+    }
+
+    for hits in scroll_pages(body, page_size, scroll, index, doc_type):
+        for hit in hits:
+            yield hit
+
+
+def tags_filter(tag_one, tag_two):
+    return [{"term": {"entities": tag_one}},
+            {"term": {"entities": tag_two}}]
+
+
+def after_filter(key):
+    """Matches sentences sorted after the (id,
+    index) sort key."""
+
+    (page_id, sentence_index) = key
+
+    return {"or": [{"range": {"id": {"gt": page_id}}},
+                   {"and": [{"term": {"id": page_id}},
+                            {"range": {"index": {"gt": sentence_index}}}]}]}
+
+
+def sentences_with_tags_after(tag_one, tag_two, after, size, source, index, doc_type):
+    """The first size hits with both tags sorted
+    after the key after, or from the start when
+    it is None."""
+
+    filters = tags_filter(tag_one, tag_two)
+    if after is not None:
+        filters.append(after_filter(after))
+
+    body = {
+        "_source": source,
+        "sort": [
+            {"id": "asc"},
+            {"index": "asc"}
+        ],
+        "query": {
+            "filtered": {
+                "filter": {
+                    "and": filters
+                }
+            }
+        }
+    }
+
     return client.search(index=index,
                          doc_type=doc_type,
                          body=body,
                          size=size)['hits']['hits']
 
+
+def sentence_key_with_tags(tag_one, tag_two, offset, index, doc_type):
+    """The (id, index) sort key of the hit offset
+    hits into the sentences with both tags, or
+    None past the end. Only that hit is sent
+    back."""
+
+    body = {
+        "from": offset,
+        "_source": False,
+        "sort": [
+            {"id": "asc"},
+            {"index": "asc"}
+        ],
+        "query": {
+            "filtered": {
+                "filter": {
+                    "and": tags_filter(tag_one, tag_two)
+                }
+            }
+        }
+    }
+
+    hits = client.search(index=index,
+                         doc_type=doc_type,
+                         body=body,
+                         size=1)['hits']['hits']
+
+    return hits[0]['sort'] if hits else None
+
+
+def page_sentences_with_tags(tag_one, tag_two, from_offset=0, page_size=config.ELASTICSEARCH_PAGE_SIZE, source=config.ELASTICSEARCH_SENTENCE_SOURCE, index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTICSEARCH_SENTENCE_TYPE):
+    """Streams the hits of get_sentences_with_tags
+    in (id, index) order, page_size hits per
+    request, starting from_offset hits in. Only
+    the source fields are sent back. Cached pages
+    are served until the first miss; from there
+    each page is fetched as the hits sorted after
+    the last one seen, so no search context is
+    kept open and no hit before from_offset is
+    downloaded."""
+
+    (page_number, skip) = divmod(from_offset, page_size)
+    after = None
+
+    while True:
+        args = [tag_one, tag_two, source, page_size, page_number]
+        hits = cache_get('page_sentences_with_tags', args, index, doc_type)
+
+        if hits is None:
+            # a first miss past the start needs the key ending the page before
+            if after is None and page_number > 0:
+                after = sentence_key_with_tags(tag_one, tag_two, page_number*page_size - 1, index, doc_type)
+                if after is None:
+                    break
+
+            hits = sentences_with_tags_after(tag_one, tag_two, after, page_size, source, index, doc_type)
+            cache_put('page_sentences_with_tags', args, index, doc_type, hits)
+
+        for hit in hits[skip:]:
+            yield hit
+
+        if len(hits) < page_size:
+            break
+
+        after = hits[-1]['sort']
+        skip = 0
+        page_number += 1
+
 ####################################################################################
 
 def term_filter(term, from_offset=0, size=config.ELASTICSEARCH_RESULTS_SIZE, index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTICSEARCH_SENTENCE_TYPE):
@@ -276,9 +729,13 @@ def get_page_by_id(page_id, index=config.ELASTICSEARCH_INDEX, doc_type=config.EL
 
 
 def get_sentence_by_ids(page_id, sentence_index, index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTICSEARCH_SENTENCE_TYPE):
-    return client.get(index=index,
-                      id="%s_%s" % (page_id, sentence_index),
-                      doc_type=doc_type)['_source']
+    return cached('get_sentence_by_ids',
+                  [page_id, sentence_index],
+                  index,
+                  doc_type,
+                  lambda: client.get(index=index,
+                                     id="%s_%s" % (page_id, sentence_index),
+                                     doc_type=doc_type)['_source'])
 
 def get_raw_sentence_by_ids(page_id, sentence_index, index=config.ELASTICSEARCH_INDEX, doc_type=config.ELASTICSEARCH_RAW_SENTENCE_TYPE):
     return client.get(index=index,
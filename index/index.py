@@ -1,61 +1,300 @@
+import os
+import Queue
 import argparse
 import logging
 
 from utils import io, log, parallel
-from corenlp import parser
+from corenlp import parser, documents
 from elastic import es
 from config import config
 
 
-class IndexWorker(parallel.Worker):
-    def __init__(self, queue, corenlp, logger):
+SENTINEL = None # tells a stage worker its inbox is done
+
+
+class Manifest:
+    """Durable record of indexing progress: which
+    files were fully indexed, and for the others,
+    how many of their first pages were, in file
+    order, and which ranges of pages were in
+    batches that failed."""
+
+    def __init__(self, path, logger, resume=False):
+        self.path = path
+        self.done = set()
+        self.pages = {} # file -> pages indexed from its start
+        self.failed = {} # file -> [(first, last)] pages of failed batches
+        partial = []
+
+        if resume and os.path.exists(path):
+            for record in io.read_records(path, partial.append):
+                if record[u'done']:
+                    self.done.add(record[u'file'])
+                    self.pages.pop(record[u'file'], None)
+                    self.failed.pop(record[u'file'], None)
+                elif u'failed' in record:
+                    self.failed.setdefault(record[u'file'], []).append(tuple(record[u'failed']))
+                else:
+                    self.pages[record[u'file']] = record[u'pages']
+
+        # a crash can leave half a record, which appending would bury
+        if partial:
+            logger.warning("Ignoring the incomplete last record of %s", path)
+            io.truncate(path, partial[0])
+
+        self.f = open(path, 'a' if resume else 'w')
+        io.write_header(self.f, u'index_manifest')
+
+
+    def write(self, record):
+        io.write_record(self.f, record)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+
+    def advance(self, path, pages, page_id):
+        self.pages[path] = pages
+        self.write({u'file': path, u'done': False, u'pages': pages, u'page': page_id})
+
+
+    def fail(self, path, first, last):
+        """Records that pages first+1 to last of path
+        were in a batch that failed. Some of them
+        may be indexed anyway, e.g. a page without
+        all its sentences."""
+
+        self.failed.setdefault(path, []).append((first, last))
+        self.write({u'file': path, u'done': False, u'failed': [first, last]})
+
+
+    def finish(self, path):
+        self.done.add(path)
+        self.pages.pop(path, None)
+        self.failed.pop(path, None)
+        self.write({u'file': path, u'done': True})
+
+
+    def close(self):
+        self.f.close()
+
+
+class StageWorker(parallel.Worker):
+    """A process of one pipeline stage. It takes
+    items off inbox until it gets a sentinel,
+    then reports its exit on progress. Not a
+    daemon, so it can finish what it holds."""
+
+    daemon = False
+    stage = None
+
+    def __init__(self, inbox, outbox, progress, logger):
         parallel.Worker.__init__(self)
-        self.queue = queue
-        self.corenlp = corenlp
+        self.inbox = inbox
+        self.outbox = outbox
+        self.progress = progress
         self.logger = logger
 
 
+    def handle(self, item):
+        pass
+
+
+    def finish(self):
+        pass
+
+
+    def failed(self, item):
+        self.progress.put(('failed', item[0], item[1], item[3]))
+
+
     def work(self):
-        self.logger.debug("Process %d has begun.", self.process.pid)
+        self.logger.debug("%s process %d has begun.", self.stage, os.getpid())
+
+        try:
+            while True:
+                item = self.inbox.get()
+                if item is SENTINEL:
+                    break
+
+                # a bad item is dropped, but the inbox keeps draining
+                try:
+                    self.handle(item)
+                except Exception:
+                    self.logger.exception("%s failed on %s", self.stage, item[0])
+                    self.failed(item)
+
+            self.finish()
+        except Exception:
+            self.logger.exception("%s process %d failed", self.stage, os.getpid())
+        finally:
+            # queues don't order puts across each other: everything sent
+            # downstream must be in the pipe before the parent, seeing the
+            # exit, puts the next stage's sentinels behind it
+            if self.outbox is not None:
+                self.outbox.close()
+                self.outbox.join_thread()
+            self.progress.put(('exit', self.stage, os.getpid(), None))
+
+
+class ReaderWorker(StageWorker):
+    """Splits extracted files into batches of
+    (page, text) pairs for the annotators. Each
+    batch carries its mark: how many pages of
+    the file come before it and where it ends,
+    and its last page id. With skip_indexed,
+    pages already in the index are left out of
+    the batches, unless they were in a batch
+    that failed."""
+
+    stage = 'reader'
+
+    def __init__(self, inbox, outbox, progress, logger, skip_indexed=False):
+        StageWorker.__init__(self, inbox, outbox, progress, logger)
+        self.skip_indexed = skip_indexed
+
+
+    def failed(self, item):
+        # the file, not a batch: its count of batches never comes
+        self.progress.put(('failed_file', item[0], None, None))
+
+
+    def send(self, path, batch_no, batch, checks, mark):
+        if self.skip_indexed:
+            indexed = es.pages_exist([page[u'id'] for ((page, _), check) in zip(batch, checks) if check])
+            batch = [(page, text) for ((page, text), check) in zip(batch, checks) if not (check and page[u'id'] in indexed)]
+
+        # empty batches still go through, to carry their mark
+        self.outbox.put((path, batch_no, batch, mark)) # blocks while the annotators are behind
+
+
+    def handle(self, item):
+        (path, skip, failed) = item
+        self.logger.info('Now processing file: %s', path)
+
+        if self.skip_indexed:
+            es.connect() # never share the parent's connections
+
+        batches = 0
+        batch = []
+        checks = [] # whether each page may be skipped if indexed
+        first = skip
+        batch_chars = 0
+
+        for (pages, (page, text)) in enumerate(documents.iter_documents(path), 1):
+
+            # pages the manifest has as indexed
+            if pages <= skip:
+                continue
+
+            # a page of a failed batch may exist without all its sentences
+            batch.append((page, text))
+            checks.append(not any(start < pages <= end for (start, end) in failed))
+            batch_chars += len(text)
+
+            # pack short pages together for CoreNLP
+            if len(batch) >= config.CORENLP_BATCH_PAGES or batch_chars >= config.CORENLP_BATCH_CHARS:
+                self.send(path, batches, batch, checks, (first, pages, page[u'id']))
+                batches += 1
+                batch = []
+                checks = []
+                first = pages
+                batch_chars = 0
+
+        if batch:
+            self.send(path, batches, batch, checks, (first, pages, page[u'id']))
+            batches += 1
 
-        while True:
+        # a file that fails partway is never done, as the count is missing
+        self.progress.put(('read', path, batches, None))
 
-            # path of next extracted file
-            path = self.queue.get()
-            self.logger.info('Now processing file: %s', path)
-            
-            # acquire file handler
-            with open(path, 'r') as f:
 
-                # loop while a doc is available
-                (xml, text) = parser.scan_next(f)
-                while xml:
+class AnnotatorWorker(StageWorker):
+    """Runs CoreNLP over batches of pages."""
 
-                    # parse
-                    parse = parser.combined_parse(xml, text, self.corenlp)
-                    page = parse['page']
-                    sentences = parse['sentences']
+    stage = 'annotator'
 
-                    # index
-                    es.index_page(page)
-                    for sentence in sentences:
-                        es.index_sentence(sentence)
+    def __init__(self, inbox, outbox, progress, logger):
+        StageWorker.__init__(self, inbox, outbox, progress, logger)
+        self.corenlp = parser.WorkerParser() # started in the worker process
 
-                    self.logger.debug("Indexed article %d: \"%s\"",
-                                      page['id'],
-                                      page['title'])
 
-                    # continue
-                    (xml, text) = parser.scan_next(f)
-            
-            # notify queue
-            self.queue.task_done()
-            self.logger.info('Done processing file: %s', path)
+    def handle(self, item):
+        (path, batch, docs, mark) = item
+
+        # one CoreNLP call for the whole batch
+        parses = parser.combined_parse_batch(docs, self.corenlp) if docs else []
+        self.outbox.put((path, batch, parses, mark))
+
+
+class IndexerWorker(StageWorker):
+    """Sends parsed pages and their sentences to
+    Elasticsearch in _bulk requests."""
+
+    stage = 'indexer'
+
+    def __init__(self, inbox, outbox, progress, logger):
+        StageWorker.__init__(self, inbox, outbox, progress, logger)
+        self.indexer = None
+
+
+    def log_failure(self, doc_type, doc_id, error):
+        self.logger.error("Failed to index %s %s: %s", doc_type, doc_id, error)
+
+
+    def handle(self, item):
+        (path, batch, parses, mark) = item
+
+        if self.indexer is None:
+            es.connect() # never share the parent's connections
+            self.indexer = es.BulkIndexer(on_error=self.log_failure)
+
+        failed = self.indexer.failed
+
+        for parse in parses:
+            page = parse['page']
+
+            # index (sent in _bulk batches); the page goes last,
+            # so pages_exist only finds pages with their sentences
+            for sentence in parse['sentences']:
+                self.indexer.index_sentence(sentence)
+            self.indexer.index_page(page)
+
+            self.logger.debug("Indexed article %d: \"%s\"",
+                              page['id'],
+                              page['title'])
+
+        # a batch only counts as done once all of it is in the index
+        self.indexer.flush()
+        if self.indexer.failed > failed:
+            self.progress.put(('failed', path, batch, mark))
+        else:
+            self.progress.put(('indexed', path, batch, mark))
+
+
+    def finish(self):
+        if self.indexer is not None:
+            self.logger.info("%d documents indexed, %d failed",
+                             self.indexer.indexed,
+                             self.indexer.failed)
+
+
+def create_stage(cls, count, inbox, outbox, progress, verbose, **kwargs):
+    workers = []
+
+    for i in xrange(count):
+        logger = log.create_logger('%s %d' % (cls.stage, i), '%s_%d.log' % (cls.stage, i))
+        if verbose:
+            logger.setLevel(logging.DEBUG)
+        workers.append(cls(inbox, outbox, progress, logger, **kwargs))
+
+    return workers
 
 
 def main(args):
     print "Running..."
 
+    logger = log.create_logger('index', 'index.log')
+
     # get extracted wikipedia file pathnames
     subdirs = io.list_directories(config.WIKIPEDIA_EXTRACTED_DIR)
     if args.letters:
@@ -64,28 +303,105 @@ def main(args):
     for sb in subdirs:
         pathnames.extend(io.list_files(sb))
     pathnames.sort()
-    
-    # create thread-safe queue
-    queue = parallel.create_queue(pathnames)
 
-    # create corenlp process
-    corenlp = parser.get_parser()
+    # skip what earlier runs finished
+    manifest = Manifest(config.WIKIPEDIA_INDEX_MANIFEST_FILE, logger, args.resume)
+    todo = [(path, manifest.pages.get(path, 0), manifest.failed.get(path, []))
+            for path in pathnames if path not in manifest.done]
+    logger.info('%d of %d files left to index', len(todo), len(pathnames))
 
-    # create workers
-    workers = []
-    for i in xrange(args.threads):
-        logger = log.create_logger('LOGGER %d' % i, 'log_%d.log' % i)
-        if args.verbose:
-            logger.setLevel(logging.DEBUG)
-        worker = IndexWorker(queue, corenlp, logger)
-        workers.append(worker)
+    # reader -> annotators -> indexers, with bounded queues in between
+    paths = parallel.create_queue(todo + [SENTINEL] * args.readers)
+    pages_queue = parallel.create_bounded_queue(config.WIKIPEDIA_INDEX_QUEUE_SIZE)
+    parses_queue = parallel.create_bounded_queue(config.WIKIPEDIA_INDEX_QUEUE_SIZE)
+    progress = parallel.create_queue()
 
-    # begin
-    for worker in workers:
-        worker.start()
+    stages = [create_stage(ReaderWorker, args.readers, paths, pages_queue, progress, args.verbose, skip_indexed=args.resume),
+              create_stage(AnnotatorWorker, args.threads, pages_queue, parses_queue, progress, args.verbose),
+              create_stage(IndexerWorker, args.indexers, parses_queue, None, progress, args.verbose)]
+    outboxes = [pages_queue, parses_queue, None]
 
-    # block until all files have been processed
-    queue.join()
+    # begin
+    for workers in stages:
+        for worker in workers:
+            worker.start()
+
+    pids = dict((worker.process.pid, k) for (k, workers) in enumerate(stages) for worker in workers)
+    running = [len(workers) for workers in stages]
+    batches = {} # path -> number of batches read from it
+    finished = {} # path -> number of batches indexed or lost
+    marks = {} # path -> {batch: mark} of indexed batches past the manifest's
+    next_batch = {} # path -> first batch not yet in the manifest
+    lost = set() # paths with batches that failed
+
+    def exited(pid):
+        k = pids.pop(pid)
+        running[k] -= 1
+
+        # once a stage is done, so is the next one's inbox
+        if running[k] == 0 and outboxes[k] is not None:
+            for _ in stages[k+1]:
+                outboxes[k].put(SENTINEL)
+
+    # follow progress until the last indexer is gone
+    while running[-1] > 0:
+        try:
+            message = progress.get(timeout=10)
+        except Queue.Empty:
+            # a worker killed outright never reports its exit
+            for workers in stages:
+                for worker in workers:
+                    if worker.process.pid in pids and not worker.process.is_alive():
+                        logger.error("%s process %d died", worker.stage, worker.process.pid)
+                        exited(worker.process.pid)
+            continue
+
+        if message[0] == 'exit':
+            exited(message[2])
+            continue
+
+        (kind, path, n, mark) = message
+        if kind == 'failed_file':
+            logger.error('Failed reading file: %s', path)
+            continue
+        elif kind == 'read':
+            batches[path] = n
+        else:
+            finished[path] = finished.get(path, 0) + 1
+            if kind == 'failed':
+                lost.add(path)
+                if mark is not None:
+                    manifest.fail(path, mark[0], mark[1])
+            else:
+                marks.setdefault(path, {})[n] = mark
+
+            # batches finish out of order; the manifest only moves
+            # past a run of indexed ones
+            k = next_batch.get(path, 0)
+            if k in marks.get(path, {}):
+                while k in marks[path]:
+                    (_, pages, page_id) = marks[path].pop(k)
+                    k += 1
+                manifest.advance(path, pages, page_id)
+                next_batch[path] = k
+
+        if path in batches and finished.get(path, 0) == batches[path]:
+            if path in lost:
+                logger.error('Failed processing file: %s', path)
+            else:
+                manifest.finish(path)
+                logger.info('Done processing file: %s', path)
+            del batches[path]
+            finished.pop(path, None)
+            marks.pop(path, None)
+            next_batch.pop(path, None)
+            lost.discard(path)
+
+    for workers in stages:
+        for worker in workers:
+            worker.join()
+
+    manifest.close()
 
     print "Done!"
 
@@ -135,7 +451,21 @@ if __name__ == '__main__':
     argparser.add_argument('-t', '--threads',
                            default=2,
                            type=int,
-                           help='Number of threads used to index')
+                           help='Number of CoreNLP annotator processes')
+
+    argparser.add_argument('--readers',
+                           default=1,
+                           type=int,
+                           help='Number of processes splitting files into pages')
+
+    argparser.add_argument('--indexers',
+                           default=1,
+                           type=int,
+                           help='Number of processes sending _bulk requests')
+
+    argparser.add_argument('-r', '--resume',
+                           action='store_true',
+                           help='Skip files and pages indexed by an earlier run, as in the manifest')
 
     argparser.add_argument('-v', '--verbose',
                            action='store_true',
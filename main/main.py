@@ -1,170 +1,571 @@
-from utils import io, log
-from classes import classes
+import os
+import argparse
+import itertools
+
+from utils import io, log, parallel, timing
+from classes import classes, scoring
 from elastic import es
+from corpus import store
 from config import config
 
 from pprint import pprint
 
 
-def main():
-    print "Running . . ."
+extraction_state = {} # read-only snapshot used by extract_shard
 
-    # initialize seeds/patterns list
-    seeds = []
-    snowball_patterns = []
-    seed_dict = io.parse_seed_file(config.SNOWBALL_SEEDS_FILE)
-    tuples = []
 
-    # output tuples/patterns files + main logger
-    tuples_f = open(config.SNOWBALL_TUPLES_FILE, 'a')
-    patterns_f = open(config.SNOWBALL_PATTERNS_FILE, 'a')
-    logger = log.create_logger("snowball", "snowball.log")
+def set_extraction_state(relations):
+    """relations lists the (seed_dict, snowball_patterns,
+    scorer, seed_index) of every relation matched
+    against the same tagged sentences."""
 
-    # partition sentence search space by iteration
-    sentence_count = config.SNOWBALL_SENTENCE_CAP
-    sentences_per_iter = sentence_count / config.SNOWBALL_NUM_ITERATIONS
-    remainder = sentence_count % config.SNOWBALL_NUM_ITERATIONS
-    counts = [sentences_per_iter] * config.SNOWBALL_NUM_ITERATIONS
-    counts[-1] += remainder # tack on remainder
+    extraction_state['relations'] = [(seed_dict,
+                                      scorer,
+                                      seed_index,
+                                      dict((id(p), k) for (k, p) in enumerate(snowball_patterns)))
+                                     for (seed_dict, snowball_patterns, scorer, seed_index) in relations]
 
-    # create initial seed and tuple sets
-    for (subj, obj) in seed_dict['pairs']:
-        tup = classes.CandidateTuple(seed_dict['rel'],
-                                     subj,
-                                     obj,
-                                     seed_dict['subj_tag'],
-                                     seed_dict['obj_tag'],
-                                     1.0)
-        seeds.append(tup)
-        tuples.append(tup)
-        
-    # some info on seeds and relation settings
-    logger.info("Relation: %r, Subject tag: %r, Object Tag: %r",
-                seed_dict['rel'],
-                seed_dict['subj_tag'],
-                seed_dict['obj_tag'])
-    logger.info("Seeds: %r", seed_dict['pairs'])
 
-    # begin
-    for i in xrange(config.SNOWBALL_NUM_ITERATIONS):
+def init_extraction_worker(relations):
+    set_extraction_state(relations)
+
+
+def extract_shard(hits):
+    """Matches the candidate tuples of a shard of
+    tagged sentence hits for every relation of the
+    extraction state, returning one result list per
+    relation, along with the shard size and the
+    pattern comparisons made per relation. Each
+    sentence is parsed only once. Patterns are
+    referred to by position in the pattern store
+    so results can be merged by the parent
+    process."""
+
+    relations = extraction_state['relations']
+    results = [[] for _ in relations]
+    comparisons = [scorer.comparisons for (_, scorer, _, _) in relations]
+
+    for hit in hits:
+        source = hit['_source']
+        sent = classes.Sentence(source['id'],
+                                source['index'],
+                                source['tokens'],
+                                source['tagged_tokens'],
+                                source.get('entity_tags'))
+
+        for ((seed_dict, scorer, seed_index, positions), relation_results) in zip(relations, results):
+            candidates = sent.extract_candidate_tuples(seed_dict['rel'],
+                                                       seed_dict['subj_tag'],
+                                                       seed_dict['obj_tag'])
+
+            scores = scorer.score([raw_pattern for (_, raw_pattern) in candidates])
+            evidence = seed_index.evidence_batch([candidate for (candidate, _) in candidates])
+
+            for ((candidate, raw_pattern), (best_similarity, best_pattern, matches), pos_neg) in zip(candidates, scores, evidence):
+                best_position = positions[id(best_pattern)] if best_pattern is not None else None
+                match_positions = [positions[id(sb_pattern)] for (_, sb_pattern) in matches]
+                relation_results.append((candidate,
+                                         (raw_pattern.page, raw_pattern.index),
+                                         (raw_pattern.tag_one, raw_pattern.tag_two),
+                                         best_similarity,
+                                         best_position,
+                                         match_positions,
+                                         pos_neg))
+
+    comparisons = [scorer.comparisons - before for ((_, scorer, _, _), before) in zip(relations, comparisons)]
+
+    return (len(hits), results, comparisons)
+
+
+def open_corpus():
+    """Returns the sentence backend picked by
+    SNOWBALL_CORPUS_BACKEND: the es module, or a
+    local CorpusStore with the same queries."""
+
+    if config.SNOWBALL_CORPUS_BACKEND == 'local':
+        return store.CorpusStore(config.SNOWBALL_CORPUS_DIR)
+
+    return es
+
+
+def write_tuples(f, tuples, iteration):
+    for tup in tuples:
+        record = tup.to_record()
+        record[u'iteration'] = iteration
+        io.write_record(f, record)
+
+    f.flush()
+
+
+def write_patterns(f, patterns, iteration):
+    for pat in patterns:
+        record = pat.to_record()
+        record[u'iteration'] = iteration
+        io.write_record(f, record)
+
+    f.flush()
+
+
+class Relation:
+    """Bootstrapping state of the relation of one
+    seeds file. Tuples, patterns and stats are
+    written next to the seeds file, under the
+    names of SNOWBALL_TUPLES_FILE,
+    SNOWBALL_PATTERNS_FILE and SNOWBALL_STATS_FILE."""
+
+    def __init__(self, seeds_path):
+        run_dir = os.path.dirname(seeds_path)
+
+        self.seeds_path = os.path.abspath(seeds_path)
+        self.tuples_path = os.path.join(run_dir, os.path.basename(config.SNOWBALL_TUPLES_FILE))
+        self.patterns_path = os.path.join(run_dir, os.path.basename(config.SNOWBALL_PATTERNS_FILE))
+        self.stats_path = os.path.join(run_dir, os.path.basename(config.SNOWBALL_STATS_FILE))
+        self.seed_dict = io.parse_seed_file(seeds_path)
+        self.tags = (self.seed_dict['subj_tag'], self.seed_dict['obj_tag'])
+        self.seeds = []
+        self.snowball_patterns = classes.PatternStore()
+        self.candidate_tuples = {}
+        self.counters = {}
+        self.tuple_count = 0
+        self.finished = False
+        self.tuples_f = None
+        self.patterns_f = None
+        self.stats_f = None
+        self.logger = log.create_logger("snowball.%s" % self.seed_dict['rel'], "snowball.log")
+
+
+    def open(self):
+        self.tuples_f = open(self.tuples_path, 'a')
+        self.patterns_f = open(self.patterns_path, 'a')
+        self.stats_f = open(self.stats_path, 'a')
+
+
+    def close(self):
+        self.tuples_f.close()
+        self.patterns_f.close()
+        self.stats_f.close()
+
+
+    def start(self):
+        """Creates the initial seed set and starts
+        the output files."""
+
+        for (subj, obj) in self.seed_dict['pairs']:
+            tup = classes.CandidateTuple(self.seed_dict['rel'],
+                                         subj,
+                                         obj,
+                                         self.seed_dict['subj_tag'],
+                                         self.seed_dict['obj_tag'],
+                                         1.0)
+            self.seeds.append(tup)
+
+        io.write_header(self.tuples_f, u'tuples')
+        io.write_header(self.patterns_f, u'patterns')
+        io.write_header(self.stats_f, u'stats')
+        write_tuples(self.tuples_f, self.seeds, 0)
+        self.tuple_count += len(self.seeds)
+
+
+    def checkpoint(self):
+        return {'seeds': self.seeds,
+                'snowball_patterns': self.snowball_patterns,
+                'tuple_count': self.tuple_count,
+                'finished': self.finished,
+                'tuples_offset': self.tuples_f.tell(),
+                'patterns_offset': self.patterns_f.tell(),
+                'stats_offset': self.stats_f.tell()}
+
+
+    def restore(self, state):
+        self.seeds = state['seeds']
+        self.snowball_patterns = state['snowball_patterns']
+        self.tuple_count = state['tuple_count']
+        self.finished = state['finished']
+
+        # drop output written after the checkpoint
+        io.truncate(self.tuples_path, state['tuples_offset'])
+        io.truncate(self.patterns_path, state['patterns_offset'])
+        io.truncate(self.stats_path, state['stats_offset'])
+
+
+    def extract_patterns(self, corpus, i, timer):
+        """Pattern extraction phase of iteration i.
+        Finishes the relation if no new patterns
+        come out of it."""
+
+        logger = self.logger
+
         logger.info("Beginning iteration %r", i+1)
 
         raw_patterns = []
-        candidate_tuples = {tup: {'matches': [],
-                                  'raw_patterns': []} for tup in seeds}
+        self.candidate_tuples = {tup: {'matches': [],
+                                       'provenance': []} for tup in self.seeds}
+        self.counters = {u'seed_sentences': 0,
+                         u'raw_patterns': 0,
+                         u'new_patterns': 0,
+                         u'candidates': 0,
+                         u'pattern_matches': 0,
+                         u'seeds': 0}
 
         logger.info("PATTERN EXTRACTION PHASE")
 
         # retrieve sentences / extract raw patterns
         logger.info("Retrieving sentences and extracting raw patterns . . .")
-        for tup in seeds:
-            count = es.count_sentences_containing(tup)
-            hits = es.get_sentences_containing(tup, 0, count)
-            
-            for hit in hits:
+        seed_hits = corpus.get_sentences_containing_batch(self.seeds)
+
+        if config.SNOWBALL_PREFETCH_SIZE > 0:
+            seed_hits = parallel.prefetch(seed_hits, config.SNOWBALL_PREFETCH_SIZE)
+
+        for (tup, hit) in timer.timed(seed_hits, 'seed_retrieval'):
+            with timer.phase('raw_pattern_extraction'):
                 source = hit['_source']
                 sent = classes.Sentence(source['id'],
                                         source['index'],
                                         source['tokens'],
-                                        source['tagged_tokens'])
+                                        source['tagged_tokens'],
+                                        source.get('entity_tags'))
                 raw_patterns.extend(sent.extract_raw_patterns(tup))
+                self.counters[u'seed_sentences'] += 1
 
+        self.counters[u'raw_patterns'] = len(raw_patterns)
         logger.info("Number of raw patterns: %d", len(raw_patterns))
-        
+
         # cluster raw patterns
         logger.info("Clustering raw patterns . . .")
-        clusterer = classes.SinglePassClusteringAlgorithm(raw_patterns,
-                                                          config.SNOWBALL_MIN_PATTERN_SIMILARITY)
-        clusterer.prepare()
-        clusterer.cluster()
+        with timer.phase('clustering'):
+            clusterer = classes.SinglePassClusteringAlgorithm(raw_patterns,
+                                                              config.SNOWBALL_MIN_PATTERN_SIMILARITY)
+            clusterer.prepare()
+            clusterer.cluster()
+        self.counters[u'pattern_matches'] += clusterer.comparisons
+
+        for (tags, size) in sorted(clusterer.partition_sizes().items()):
+            logger.info("Partition %r: %d clusters", tags, size)
 
         new_snowball_patterns = clusterer.get_snowball_patterns()
 
         if len(new_snowball_patterns) == 0:
             logger.info("No new patterns. Prematurely exiting on iteration %d", i+1)
-            break
+            self.finished = True
+            return
 
-        snowball_patterns.extend(new_snowball_patterns)        
-        
-        logger.info("Total number of patterns: %d", len(snowball_patterns))
-
-        logger.info("Writing new patterns to: %r", config.SNOWBALL_TUPLES_FILE)
-        for pat in new_snowball_patterns:
-            io.write_line(patterns_f, pat)
-
-        logger.info("TUPLE EXTRACTION PHASE")
-
-        logger.info("Searching through sentences . . .")
-
-        # retrieve sentences one at a time to avoid blowing up memory
-        for j in xrange(counts[i]):
-            from_offset = j + i*sentences_per_iter
-            source = es.get_sentences_with_tags(seed_dict['subj_tag'],
-                                                seed_dict['obj_tag'],
-                                                from_offset,
-                                                1)[0]['_source']
-            sent = classes.Sentence(source['id'],
-                                    source['index'],
-                                    source['tokens'],
-                                    source['tagged_tokens'])
-            candidates = sent.extract_candidate_tuples(seed_dict['rel'],
-                                                       seed_dict['subj_tag'],
-                                                       seed_dict['obj_tag'])
+        self.snowball_patterns.extend(new_snowball_patterns)
+        self.counters[u'new_patterns'] = len(new_snowball_patterns)
+
+        logger.info("Total number of patterns: %d", len(self.snowball_patterns))
 
-            for (candidate, raw_pattern) in candidates:
-                best_similarity = 0.0
-                best_pattern = None
+        logger.info("Writing new patterns to: %r", self.patterns_path)
+        write_patterns(self.patterns_f, new_snowball_patterns, i+1)
 
-                for sb_pattern in snowball_patterns:
-                    similarity = sb_pattern.match(raw_pattern)
 
-                    if similarity >= config.SNOWBALL_MIN_PATTERN_SIMILARITY:
-                        sb_pattern.update_confidence(candidate, seeds)
+    def merge(self, results, comparisons):
+        """Folds the extract_shard results of one
+        shard into the candidate tuples and pattern
+        confidences."""
 
-                        if similarity >= best_similarity:
-                            best_similarity = similarity
-                            best_pattern = sb_pattern
+        snowball_patterns = self.snowball_patterns
+        candidate_tuples = self.candidate_tuples
+        pattern_evidence = {} # store position -> [(pos, neg)]
+        self.counters[u'candidates'] += len(results)
+        self.counters[u'pattern_matches'] += comparisons
 
-                if best_similarity >= config.SNOWBALL_MIN_PATTERN_SIMILARITY:
-                    if candidate not in candidate_tuples:
-                        candidate_tuples[candidate] = {'matches': [],
-                                                       'raw_patterns': []}
-                    candidate_tuples[candidate]['matches'].append((best_similarity,
-                                                                       best_pattern))
-                    candidate_tuples[candidate]['raw_patterns'].append(raw_pattern)
+        for (candidate, provenance, tags, best_similarity, best_position, match_positions, pos_neg) in results:
+            snowball_patterns.record(tags,
+                                     1,
+                                     1 if best_position is not None else 0)
+
+            for position in match_positions:
+                pattern_evidence.setdefault(position, []).append(pos_neg)
+
+            if best_similarity >= config.SNOWBALL_MIN_PATTERN_SIMILARITY:
+                if candidate not in candidate_tuples:
+                    candidate_tuples[candidate] = {'matches': [],
+                                                   'provenance': []}
+                candidate_tuples[candidate]['matches'].append((best_similarity,
+                                                               snowball_patterns.patterns[best_position]))
+                candidate_tuples[candidate]['provenance'].append(provenance)
+
+        for (position, pattern_pos_neg) in pattern_evidence.items():
+            snowball_patterns.patterns[position].add_evidence(pattern_pos_neg)
+
+
+    def select_seeds(self, corpus, i, timer):
+        """Ends iteration i by scoring the candidate
+        tuples and writing out the new seeds.
+        Finishes the relation if there are none."""
+
+        logger = self.logger
+        snowball_patterns = self.snowball_patterns
+        candidate_tuples = self.candidate_tuples
+
+        for tags in sorted(set(snowball_patterns.tag_pairs()) | set(snowball_patterns.stats)):
+            stats = snowball_patterns.stats.get(tags, {'candidates': 0, 'matches': 0})
+            logger.info("Partition %r: %d patterns, %d candidates, %d matched",
+                        tags,
+                        len(snowball_patterns.partition(*tags)),
+                        stats['candidates'],
+                        stats['matches'])
 
         new_tuples = candidate_tuples.keys()
 
         logger.info("Number of candidate tuples: %d", len(new_tuples))
+        logger.info("Sentence cache: %d hits, %d misses", *corpus.cache_stats())
 
-        for new_tuple in new_tuples:
-            new_tuple.update_confidence(candidate_tuples[new_tuple]['matches'], snowball_patterns)
-            new_tuple.add_patterns(candidate_tuples[new_tuple]['raw_patterns'])
+        with timer.phase('confidence_updates'):
+            for new_tuple in new_tuples:
+                new_tuple.update_confidence(candidate_tuples[new_tuple]['matches'], snowball_patterns)
+                for (page, index) in candidate_tuples[new_tuple]['provenance']:
+                    new_tuple.add_provenance(page, index)
 
+        self.candidate_tuples = {}
         seeds = [tup for tup in new_tuples if tup.confidence() >= config.SNOWBALL_MIN_TUPLE_CONFIDENCE]
 
         if len(seeds) == 0:
             logger.info("No new seeds. Prematurely exiting on iteration %d", i+1)
-            break
+            self.finished = True
+            return
+
+        self.seeds = seeds
+        self.counters[u'seeds'] = len(seeds)
 
-        tuples.extend(seeds) # store everything
+        logger.info("Writing seed tuples to: %r", self.tuples_path)
+        write_tuples(self.tuples_f, seeds, i+1) # store everything
+        self.tuple_count += len(seeds)
 
         logger.info("Number of seed tuples: %d", len(seeds))
 
-        logger.info("Total tuples so far (roughly): %d", len(tuples))
+        logger.info("Total tuples so far (roughly): %d", self.tuple_count)
 
         logger.info("Ending iteration %d", i+1)
 
-    logger.info("Writing tuples to: %r", config.SNOWBALL_TUPLES_FILE)
-    for tup in tuples:
-        io.write_line(tuples_f, tup)
+
+    def write_stats(self, i, timer, counters):
+        """Writes the stats record of iteration i:
+        the run's phase timings and counters plus
+        those of this relation."""
+
+        record = {u'iteration': i+1,
+                  u'relation': self.seed_dict['rel'],
+                  u'phases': timer.to_record(),
+                  u'counters': dict(counters)}
+        record[u'counters'].update(self.counters)
+
+        io.write_record(self.stats_f, record)
+        self.stats_f.flush()
+
+        self.logger.info("Phase times (wall seconds): %s",
+                         ", ".join("%s %.2f" % (name, timer.wall[name]) for name in sorted(timer.wall)))
+
+
+def extract_tuples(relations, sentence_stream, count, timer):
+    """Tuple extraction phase for relations sharing
+    a tag pair: the next count sentences of their
+    stream are read once and matched against the
+    patterns of every relation. Returns the number
+    of sentences read."""
+
+    timer.start('matching')
+    extraction = []
+    read = 0
+
+    for relation in relations:
+        relation.logger.info("TUPLE EXTRACTION PHASE")
+        relation.logger.info("Searching through sentences . . .")
+        relation.snowball_patterns.reset_stats()
+        scorer = scoring.PartitionedScorer(relation.snowball_patterns,
+                                           config.SNOWBALL_MIN_PATTERN_SIMILARITY)
+        extraction.append((relation.seed_dict,
+                           relation.snowball_patterns,
+                           scorer,
+                           classes.SeedIndex(relation.seeds)))
+
+    set_extraction_state(extraction)
+    shards = timer.timed(parallel.chunks(itertools.islice(sentence_stream, count),
+                                         config.SNOWBALL_SHARD_SIZE),
+                         'sentence_retrieval')
+
+    # shards are pulled off the stream lazily to avoid blowing up memory
+    if config.SNOWBALL_NUM_PROCESSES > 1:
+        pool = parallel.create_pool(config.SNOWBALL_NUM_PROCESSES,
+                                    init_extraction_worker,
+                                    (extraction,))
+        shard_results = parallel.imap_bounded(pool,
+                                              extract_shard,
+                                              shards,
+                                              2*config.SNOWBALL_NUM_PROCESSES)
+    else:
+        pool = None
+        shard_results = (extract_shard(shard) for shard in shards)
+
+    # merge in shard order so results match a serial run
+    for (shard_size, results, comparisons) in shard_results:
+        read += shard_size
+
+        with timer.phase('confidence_updates'):
+            for (relation, relation_results, relation_comparisons) in zip(relations, results, comparisons):
+                relation.merge(relation_results, relation_comparisons)
+
+    # joined workers' CPU time is charged to matching
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    timer.stop()
+
+    return read
+
+
+def checkpoint_path(relations):
+    """Checkpoint of a run, next to the seeds file
+    of its first relation, under the name of
+    SNOWBALL_CHECKPOINT_FILE."""
+
+    run_dir = os.path.dirname(relations[0].seeds_path)
+
+    return os.path.join(run_dir, os.path.basename(config.SNOWBALL_CHECKPOINT_FILE))
+
+
+def save_checkpoint(path, state, relations):
+    state['relations'] = dict((relation.seeds_path, relation.checkpoint()) for relation in relations)
+
+    # the vocabulary goes first so contexts unpickle to the same ids
+    io.save_checkpoint(path, [classes.vocabulary, state])
+
+
+def load_checkpoint(path, relations):
+    checkpoint = io.load_checkpoint(path)
+    classes.vocabulary.restore(next(checkpoint))
+    state = next(checkpoint)
+
+    if sorted(state['relations']) != sorted(relation.seeds_path for relation in relations):
+        raise ValueError("Checkpoint %s is for seed files %r" % (path, sorted(state['relations'])))
+
+    for relation in relations:
+        relation.restore(state['relations'][relation.seeds_path])
+
+    return state
+
+
+def main(args):
+    print "Running . . ."
+
+    relations = [Relation(path) for path in args.seeds]
+    corpus = open_corpus()
+    state = None
+
+    outputs = set(relation.tuples_path for relation in relations)
+    if len(outputs) < len(relations):
+        raise ValueError("Every seeds file needs a directory of its own")
+
+    checkpoint = args.checkpoint or checkpoint_path(relations)
+
+    if args.resume and os.path.exists(checkpoint):
+        state = load_checkpoint(checkpoint, relations)
+        for relation in relations:
+            relation.logger.info("Resuming after iteration %d", state['iteration'])
+
+    # output tuples/patterns files
+    for relation in relations:
+        relation.open()
+
+    # partition sentence search space by iteration
+    sentence_count = config.SNOWBALL_SENTENCE_CAP
+    sentences_per_iter = sentence_count / config.SNOWBALL_NUM_ITERATIONS
+    remainder = sentence_count % config.SNOWBALL_NUM_ITERATIONS
+    counts = [sentences_per_iter] * config.SNOWBALL_NUM_ITERATIONS
+    counts[-1] += remainder # tack on remainder
+
+    # relations sharing a tag pair share its sentences
+    tag_pairs = []
+    for relation in relations:
+        if relation.tags not in tag_pairs:
+            tag_pairs.append(relation.tags)
+
+    # create initial seed and tuple sets
+    if state is None:
+        for relation in relations:
+            relation.start()
+        state = {'iteration': 0}
+
+    # some info on seeds and relation settings
+    for relation in relations:
+        relation.logger.info("Relation: %r, Subject tag: %r, Object Tag: %r",
+                             relation.seed_dict['rel'],
+                             relation.seed_dict['subj_tag'],
+                             relation.seed_dict['obj_tag'])
+        relation.logger.info("Seeds: %r", relation.seed_dict['pairs'])
+
+    # begin
+    for i in xrange(state['iteration'], config.SNOWBALL_NUM_ITERATIONS):
+        if all(relation.finished for relation in relations):
+            break
+
+        timer = timing.PhaseTimer()
+        requests = corpus.request_count()
+        (cache_hits, cache_misses) = corpus.cache_stats()
+        sentences = 0
+        running = [relation for relation in relations if not relation.finished]
+
+        for relation in running:
+            relation.extract_patterns(corpus, i, timer)
+
+        # fan each tag pair's sentences out to the relations using it
+        for tags in tag_pairs:
+            active = [relation for relation in running if relation.tags == tags and not relation.finished]
+
+            if active:
+                # a stream per iteration, starting at its share of the sentences,
+                # so nothing is held open while patterns are extracted
+                sentence_stream = corpus.page_sentences_with_tags(tags[0],
+                                                                  tags[1],
+                                                                  i*sentences_per_iter)
+                try:
+                    sentences += extract_tuples(active, sentence_stream, counts[i], timer)
+                finally:
+                    sentence_stream.close()
+
+                for relation in active:
+                    relation.select_seeds(corpus, i, timer)
+
+        counters = {u'relations': len(running),
+                    u'sentences': sentences,
+                    u'es_requests': corpus.request_count() - requests,
+                    u'cache_hits': corpus.cache_stats()[0] - cache_hits,
+                    u'cache_misses': corpus.cache_stats()[1] - cache_misses}
+
+        # matching is shared by the relations, so the rate is overall
+        candidates = sum(relation.counters[u'candidates'] for relation in running)
+        matching = timer.wall.get('matching', 0.0)
+        counters[u'candidates_per_second'] = candidates / matching if matching > 0 else 0.0
+
+        for relation in running:
+            relation.write_stats(i, timer, counters)
+
+        state['iteration'] = i+1
+        save_checkpoint(checkpoint, state, relations)
 
     # close files
-    tuples_f.close()
-    patterns_f.close()
+    for relation in relations:
+        relation.close()
 
     print "Done!"
 
 
 if __name__ == '__main__':
-    main()
+    argparser = argparse.ArgumentParser()
+
+    argparser.add_argument('-s', '--seeds',
+                           nargs='+',
+                           default=[config.SNOWBALL_SEEDS_FILE],
+                           help='Seeds files, one per relation; each gets its own output directory')
+
+    argparser.add_argument('-r', '--resume',
+                           action='store_true',
+                           help='Resume from the last completed iteration')
+
+    argparser.add_argument('-c', '--checkpoint',
+                           help='Checkpoint file of the run (next to the first seeds file by default)')
+
+    args = argparser.parse_args()
+
+    main(args)
@@ -1,5 +1,10 @@
 import json
 import os
+import cPickle as pickle
+
+
+RECORD_FORMAT = u'snowball'
+RECORD_VERSION = 1
 
 
 def to_unicode(text, encoding='utf-8'):
@@ -22,6 +27,46 @@ def write_string(f, string):
     f.write(to_string(string) + "\n")
 
 
+def write_header(f, kind):
+    """Starts a run of records in f. Files opened
+    for appending may hold several runs."""
+
+    write_record(f, {u'format': RECORD_FORMAT,
+                     u'version': RECORD_VERSION,
+                     u'kind': kind})
+
+
+def write_record(f, record):
+    f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def read_records(path, on_partial=None):
+    """Lazily yields the records of a file written
+    with write_header/write_record, skipping the
+    headers. A last line cut short by a crash is
+    an error, unless on_partial is given: it is
+    then called with the line's offset and the
+    line is skipped."""
+
+    with open(path) as f:
+        offset = 0
+
+        for line in f:
+            if on_partial is not None and not line.endswith("\n"):
+                on_partial(offset)
+                return
+
+            offset += len(line)
+            record = json.loads(line)
+
+            if record.get(u'format') == RECORD_FORMAT:
+                if record[u'version'] > RECORD_VERSION:
+                    raise ValueError("Unsupported record version %r in %s" % (record[u'version'], path))
+                continue
+
+            yield record
+
+
 def load_json(path):
     j = None
 
@@ -35,6 +80,40 @@ def save_json(j, f):
     json.dump(j, f, sort_keys=True, indent=4)
 
 
+def save_checkpoint(path, objects):
+    """Atomically replaces path with the pickles
+    of objects: a crash leaves either the old or
+    the new checkpoint, never a partial one."""
+
+    tmp_path = "%s.tmp" % path
+
+    with open(tmp_path, 'wb') as f:
+        for obj in objects:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.rename(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """Lazily yields the objects saved by
+    save_checkpoint, so each can be put in
+    place before the next is unpickled."""
+
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def truncate(path, size):
+    with open(path, 'r+b') as f:
+        f.truncate(size)
+
+
 def list_files(path):
     return [os.path.join(path, f) for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
 
@@ -1,3 +1,8 @@
+import sys
+import Queue
+import itertools
+import threading
+import collections
 import multiprocessing as mp
 
 
@@ -12,7 +17,85 @@ def create_queue(data=[]):
     return q
 
 
+def create_bounded_queue(size):
+    """A queue whose put blocks while size items
+    are waiting, so producers can't outrun their
+    consumers."""
+
+    return mp.Queue(size)
+
+
+def create_pool(processes, initializer=None, initargs=()):
+    return mp.Pool(processes, initializer, initargs)
+
+
+def chunks(iterable, size):
+    """Lazily groups an iterable into lists of
+    at most size items."""
+
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
+def imap_bounded(pool, func, iterable, window):
+    """Like pool.imap, but never reads more than
+    window items of iterable ahead of the
+    consumer. Results come back in order."""
+
+    pending = collections.deque()
+
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+
+        if len(pending) >= window:
+            yield pending.popleft().get()
+
+    while pending:
+        yield pending.popleft().get()
+
+
+def prefetch(iterable, size):
+    """Iterates over iterable in a background
+    thread, buffering up to size items ahead of
+    the consumer. Exceptions are re-raised in
+    the consuming thread."""
+
+    q = Queue.Queue(maxsize=size)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                q.put((True, item))
+            q.put((True, done))
+        except:
+            q.put((False, sys.exc_info()))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+
+    while True:
+        (ok, item) = q.get()
+
+        if not ok:
+            raise item[0], item[1], item[2]
+
+        if item is done:
+            break
+
+        yield item
+
+    thread.join()
+
+
 class Worker:
+    daemon = True # daemon processes are killed when the parent exits
+
     def __init__(self):
         self.process = None
 
@@ -23,7 +106,7 @@ class Worker:
 
     def start(self):
         self.process = mp.Process(target=self.work)
-        self.process.daemon = True
+        self.process.daemon = self.daemon
         self.process.start()
 
 
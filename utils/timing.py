@@ -0,0 +1,77 @@
+import os
+import time
+import contextlib
+
+
+def cpu_time():
+    """CPU seconds used by this process and its
+    reaped children, e.g. joined pool workers."""
+
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+class PhaseTimer:
+    """Wall and CPU time per named phase. Phases
+    nest: time spent in an inner phase is not
+    charged to the outer one."""
+
+    def __init__(self):
+        self.wall = {}
+        self.cpu = {}
+        self.stack = []
+        self.mark = None # (wall, cpu) when the innermost phase last resumed
+
+
+    def charge(self):
+        now = (time.time(), cpu_time())
+
+        if self.stack:
+            name = self.stack[-1]
+            self.wall[name] = self.wall.get(name, 0.0) + now[0] - self.mark[0]
+            self.cpu[name] = self.cpu.get(name, 0.0) + now[1] - self.mark[1]
+
+        self.mark = now
+
+
+    def start(self, name):
+        self.charge()
+        self.stack.append(name)
+
+
+    def stop(self):
+        self.charge()
+        self.stack.pop()
+
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop()
+
+
+    def timed(self, iterable, name):
+        """Iterates over iterable, charging the time
+        spent waiting for each item to phase name."""
+
+        iterator = iter(iterable)
+
+        while True:
+            self.start(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.stop()
+
+            yield item
+
+
+    def to_record(self):
+        return dict((name, {u'wall': self.wall[name],
+                            u'cpu': self.cpu[name]})
+                    for name in self.wall)